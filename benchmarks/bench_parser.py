@@ -0,0 +1,102 @@
+## Benchmark of the understat page parser: byte extractor against the full BeautifulSoup parse
+##
+## Usage:   python benchmarks/bench_parser.py [pages_dir] [repeat]
+##
+## The real understat pages of benchmarks/fixtures/understat (committed) are always parsed. 'pages_dir' adds
+## further pages (<match_id>.html); if it holds none, synthetic pages with the understat layout are written there
+## first, so that the timings cover more than a handful of pages.
+
+import os
+import sys
+import json
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from myfootballanalytics.mfa import parse_match_page
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pages")
+REAL_PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "understat")
+
+## Function to escape a JSON string the way understat embeds it (every non alphanumeric character as \xNN)
+
+def escape(text):
+    return ''.join(c if c.isalnum() or c in ' .' else '\\x%02X' % ord(c) for c in text)
+
+## Function to build a page with the layout of an understat match page
+
+def synthetic_page(match_id,rng):
+    teams = ["Bayern Munich","FC Cologne"]
+    shots = {'h': [], 'a': []}
+    for side in ('h','a'):
+        for k in range(rng.randint(5,20)):
+            shots[side].append({'id': str(match_id*100 + len(shots['h']) + k), 'minute': str(rng.randint(1,95)),
+                                'result': rng.choice(['Goal','MissedShots','SavedShot','BlockedShot','ShotOnPost']),
+                                'X': '%.15f' % rng.uniform(0.6,0.99), 'Y': '%.15f' % rng.uniform(0.2,0.8),
+                                'xG': '%.15f' % rng.uniform(0.01,0.8), 'player': 'Jérôme Müller %d' % rng.randint(1,12),
+                                'h_a': side, 'player_id': str(rng.randint(1,9999)),
+                                'situation': rng.choice(['OpenPlay','SetPiece','FromCorner','Penalty','DirectFreekick']),
+                                'season': '2022', 'shotType': rng.choice(['RightFoot','LeftFoot','Head']),
+                                'match_id': str(match_id), 'h_team': teams[0], 'a_team': teams[1], 'h_goals': '2', 'a_goals': '1',
+                                'date': '2022-09-01 15:30:00', 'player_assisted': None, 'lastAction': 'Pass'})
+    rosters = {side: {str(k): {'id': str(k), 'goals': '0', 'own_goals': '0', 'shots': '1', 'xG': '0.1', 'time': '90',
+                               'player_id': str(k), 'team_id': '117', 'position': 'FW', 'player': 'Player %d' % k,
+                               'h_a': side, 'yellow_card': '0', 'red_card': '0', 'roster_in': '0', 'roster_out': '0',
+                               'key_passes': '1', 'assists': '0', 'xA': '0.05', 'xGChain': '0.3', 'xGBuildup': '0.2',
+                               'positionOrder': '1'} for k in range(16)} for side in ('h','a')}
+    chrome = "".join("<div class=\"block\"><ul><li><a href=\"/league/Bundesliga\">Link %d</a></li></ul></div>\n" % k for k in range(300))
+    return ("<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Bayern Munich - FC Cologne | xG | Understat.com</title>"
+            "<script src=\"js/jquery.js\"></script></head><body>" + chrome +
+            "<script>\n\tvar shotsData\t= JSON.parse('" + escape(json.dumps(shots)) + "');\n"
+            "\tvar match_info = JSON.parse('" + escape(json.dumps({'id': str(match_id), 'team_h': teams[0], 'team_a': teams[1]})) + "');\n</script>"
+            "<script>\n\tvar rostersData\t= JSON.parse('" + escape(json.dumps(rosters)) + "');\n</script>"
+            "<script src=\"js/app.min.js\"></script></body></html>")
+
+def read_pages(pages_dir):
+    pages = []
+    for f in sorted(os.listdir(pages_dir)):
+        if f.endswith(".html"):
+            with open(os.path.join(pages_dir,f),"rb") as g:
+                pages.append(g.read())
+    return pages
+
+def load_real_pages():
+    return read_pages(REAL_PAGES_DIR)
+
+def load_pages(pages_dir):
+    ## The real pages followed by those of 'pages_dir'
+    if not os.path.isdir(pages_dir) or not any(f.endswith(".html") for f in os.listdir(pages_dir)):
+        os.makedirs(pages_dir,exist_ok=True)
+        rng = random.Random(1)
+        for match_id in range(22000,22050):
+            with open(os.path.join(pages_dir,str(match_id) + ".html"),"w",encoding="utf8") as f:
+                f.write(synthetic_page(match_id,rng))
+    return load_real_pages() + read_pages(pages_dir)
+
+def run(pages,fast,repeat):
+    best = None
+    for r in range(repeat):
+        start = time.perf_counter()
+        results = [parse_match_page(content,fast=fast) for content in pages]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best,elapsed)
+    return best, results
+
+def main():
+    pages_dir = sys.argv[1] if len(sys.argv) > 1 else PAGES_DIR
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    pages = load_pages(pages_dir)
+    real = len(load_real_pages())
+    t_soup, soup = run(pages,False,repeat)
+    t_fast, fast = run(pages,True,repeat)
+    if any(len(r.get('h',[])) + len(r.get('a',[])) == 0 for r in fast[:real]):
+        exit("No shot found in at least one real understat page")
+    if soup != fast:
+        exit("The extractor and the BeautifulSoup parse disagree on at least one page")
+    size = sum(len(p) for p in pages) / len(pages) / 1024
+    print("{} pages ({} saved from understat, {:.0f} KB on average), best of {}".format(len(pages),real,size,repeat))
+    print("BeautifulSoup: {:8.2f} ms/page".format(t_soup / len(pages) * 1000))
+    print("Extractor:     {:8.2f} ms/page  ({:.0f}x faster)".format(t_fast / len(pages) * 1000,t_soup / t_fast))
+
+if __name__ == "__main__":
+    main()
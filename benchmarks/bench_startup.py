@@ -0,0 +1,49 @@
+## Benchmark of the start-up time of the package and of its command line interface
+##
+## Usage:   python benchmarks/bench_startup.py [repeat] [max_seconds]
+##
+## Each command runs in a fresh interpreter. The script exits with an error if the best time of a command exceeds
+## 'max_seconds' (default 1.0) or if importing the package loads one of the heavy dependencies.
+
+import os
+import sys
+import time
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+HEAVY = ["pandas","numpy","pyarrow","matplotlib","mplsoccer","bs4","aiohttp","tqdm"]
+
+COMMANDS = {"import": [sys.executable, "-c", "import myfootballanalytics"],
+            "cli --help": [sys.executable, "-m", "myfootballanalytics", "--help"],
+            "cli match --help": [sys.executable, "-m", "myfootballanalytics", "match", "--help"]}
+
+def run(command,repeat,env):
+    best = None
+    for r in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command,env=env,check=True,stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best,elapsed)
+    return best
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    max_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH",""))
+    failed = []
+    baseline = run([sys.executable, "-c", "pass"],repeat,env)
+    print("{:<20} {:8.1f} ms".format("python",baseline * 1000))
+    for name, command in COMMANDS.items():
+        best = run(command,repeat,env)
+        print("{:<20} {:8.1f} ms".format(name,best * 1000))
+        if best > max_seconds:
+            failed.append("'{}' takes {:.2f} s (limit {:.2f} s)".format(name,best,max_seconds))
+    code = "import sys, myfootballanalytics; print(' '.join(m for m in {} if m in sys.modules))".format(HEAVY)
+    loaded = subprocess.run([sys.executable, "-c", code],env=env,check=True,capture_output=True,text=True).stdout.split()
+    if loaded:
+        failed.append("importing the package loads " + ", ".join(loaded))
+    if failed:
+        exit("\n".join(failed))
+
+if __name__ == "__main__":
+    main()
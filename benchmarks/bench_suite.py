@@ -0,0 +1,245 @@
+## Benchmark suite of the main stages: page parsing, season loading, league aggregates, team values, csv export
+## and figure rendering, on synthetic data of realistic scale
+##
+## Usage:   python benchmarks/bench_suite.py [--repeat 3] [--output results.json] [--baseline old_results.json]
+##
+## The shots (default: 5 leagues x 9 seasons x 380 matches x ~25 shots) are written once to benchmarks/fixtures/data
+## through ShotStore and AggregateStore; the understat pages are those of bench_parser.py (the real pages of
+## benchmarks/fixtures/understat and the pages of benchmarks/fixtures/pages).
+## Every stage reports the best time per unit (page, season, team, report) so the results do not depend on the scale.
+## The script exits with an error if a stage exceeds its limit in thresholds.json, or if it is more than 'tolerance'
+## slower than in the results given by --baseline.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import io
+import warnings
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import pandas as pd
+import myfootballanalytics.mfa as mfa
+from bench_parser import PAGES_DIR, load_pages
+
+DATA_DIR = os.path.join(BENCH_DIR, "fixtures", "data")
+THRESHOLDS = os.path.join(BENCH_DIR, "thresholds.json")
+LEAGUES = ['PremierLeague','Ligue1','Bundesliga','LaLiga','SerieA']
+
+## Function to build the shots of one season: a double round robin of 'teams' with ~'shots' shots per match,
+## with the columns and value ranges of understat
+
+def synthetic_season(league,year,teams,shots,first_id,rng):
+    home, away = zip(*[(h, a) for h in teams for a in teams if h != a])
+    home, away = np.array(home,dtype=object), np.array(away,dtype=object)
+    per_match = np.maximum(rng.poisson(shots,len(home)),1)
+    match = np.repeat(np.arange(len(home)),per_match)
+    n = len(match)
+    situation = rng.choice(['OpenPlay','FromCorner','SetPiece','DirectFreekick','Penalty'],n,p=[0.72,0.12,0.1,0.03,0.03])
+    xG = np.where(situation == 'Penalty',0.76,np.clip(rng.beta(1.1,9,n),0.005,0.99)).astype('float32')
+    goal = rng.random(n) < xG
+    side = np.where(rng.random(n) < 0.55,'h','a')
+    h_goals = np.bincount(match,weights=goal & (side == 'h'),minlength=len(home)).astype(int)
+    a_goals = np.bincount(match,weights=goal & (side == 'a'),minlength=len(home)).astype(int)
+    shooter = np.where(side == 'h',home[match],away[match])
+    number = rng.integers(1,19,n)
+    results = np.where(goal,'Goal',rng.choice(['MissedShots','SavedShot','BlockedShot','ShotOnPost'],n,p=[0.4,0.3,0.27,0.03]))
+    return pd.DataFrame({'id': first_id * 100 + np.arange(n), 'minute': rng.integers(1,96,n), 'result': results,
+                         'X': rng.uniform(0.65,0.99,n).astype('float32'), 'Y': rng.uniform(0.2,0.8,n).astype('float32'), 'xG': xG,
+                         'player': [t + " player " + str(k) for t, k in zip(shooter,number)], 'h_a': side,
+                         'player_id': rng.integers(1,20000,n), 'situation': situation, 'season': year,
+                         'shotType': rng.choice(['RightFoot','LeftFoot','Head','OtherBodyPart'],n,p=[0.5,0.3,0.19,0.01]),
+                         'match_id': first_id + match, 'h_team': home[match], 'a_team': away[match],
+                         'h_goals': h_goals[match], 'a_goals': a_goals[match],
+                         'date': str(year) + "-09-01 15:30:00", 'player_assisted': None,
+                         'lastAction': rng.choice(['Pass','Cross','Rebound','TakeOn','None'],n)})
+
+## Function to write the synthetic store, unless one of the same scale is there already
+
+def build_data(scale,data_dir):
+    marker = os.path.join(data_dir,"Football_Data","synthetic.json")
+    if os.path.isfile(marker):
+        with open(marker) as rf:
+            if json.load(rf) == scale:
+                return
+    shutil.rmtree(data_dir,ignore_errors=True)
+    with open(os.path.join(BENCH_DIR,"..","myfootballanalytics","teams_dict.json")) as rf:
+        leagues = {}
+        for team, league in json.load(rf).items():
+            leagues.setdefault(league,[]).append(team)
+    n_teams = int(round((1 + (1 + 4 * scale['matches']) ** 0.5) / 2))   ## n (n-1) matches per season
+    rng = np.random.default_rng(1)
+    store, aggregates = mfa.ShotStore(data_dir), mfa.AggregateStore(data_dir)
+    start = time.perf_counter()
+    match_id = 1
+    for league in LEAGUES[:scale['leagues']]:
+        pool = sorted(leagues[league])
+        for j in range(scale['seasons']):
+            year = 2014 + j
+            teams = [pool[(j + k) % len(pool)] for k in range(n_teams)]   ## Promotions and relegations
+            data = synthetic_season(league,year,teams,scale['shots'],match_id,rng)
+            match_id = int(data['match_id'].max()) + 1
+            season = str(year) + "-" + str(year + 1)
+            store.write(data,league,season)
+            aggregates.write(store.read(league,season),league,season)
+    with open(marker,"w") as wf:
+        json.dump(scale,wf)
+    print("Synthetic data written in {:.1f} s".format(time.perf_counter() - start))
+
+## Function to time 'run' (best of 'repeat'); 'setup' runs before every repetition and is not timed
+
+def measure(run,repeat,units=1,setup=None):
+    best = None
+    for r in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best,elapsed)
+    return best / units
+
+def quiet(function,*args):
+    with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+        warnings.simplefilter('ignore')
+        return function(*args)
+
+def run_stages(data_dir,leagues,seasons,league,team,match,pages,repeat,only):
+    clear = lambda: mfa.season_cache.invalidate()
+    store = mfa.ShotStore(data_dir)
+    tmp = tempfile.mkdtemp()
+    stages = {}
+    
+    stages['parse_extract'] = lambda: measure(lambda: [mfa.parse_match_page(p) for p in pages],repeat,len(pages))
+    stages['parse_soup'] = lambda: measure(lambda: [mfa.parse_match_page(p,fast=False) for p in pages],repeat,len(pages))
+    stages['parse_normalize'] = lambda: measure(lambda: [mfa.normalize_match(p) for p in pages],repeat,len(pages))
+    stages['load_season_cold'] = lambda: measure(lambda: [store.read(league,s) for s in seasons],repeat,len(seasons),clear)
+    stages['load_season_warm'] = lambda: measure(lambda: [store.read(league,s) for s in seasons],repeat,len(seasons))
+    for s in seasons:   ## The memory-mapped columns are exported once, outside the timings
+        store.map_season(league,s)
+    stages['load_season_mapped'] = lambda: measure(lambda: [store.map_season(league,s) for s in seasons],repeat,len(seasons),clear)
+    stages['load_league_seasons'] = lambda: measure(lambda: store.load(league,seasons),repeat,len(seasons),clear)
+    stages['load_team_shots'] = lambda: measure(lambda: mfa.TeamDataLoader(seasons,team,data_dir).load_team_data(),repeat,1,clear)
+    stages['load_team_compact'] = lambda: measure(lambda: mfa.TeamDataLoader(seasons,team,data_dir).load_team_data(compact=True),repeat,1,clear)
+    stages['load_team_mapped'] = lambda: measure(lambda: mfa.TeamDataLoader(seasons,team,data_dir).load_team_data(mapped=True),repeat,1,clear)
+    stages['load_team_matches'] = lambda: measure(lambda: mfa.TeamDataLoader(seasons,team,data_dir).load_team_matches(),repeat,1,clear)
+    
+    shots = dict((s, store.read(league,s,columns=['result','player','xG'])) for s in seasons)
+    matches = dict((s, mfa.AggregateStore(data_dir).read("team_matches",league,[s])) for s in seasons)
+    def league_aggregates():
+        for s in seasons:
+            aggregates = mfa.LeagueAggregator(shots[s],matches[s])
+            aggregates.team_table()
+            aggregates.player_table()
+    stages['league_aggregates'] = lambda: measure(league_aggregates,repeat,len(seasons))
+    mapped = dict((s, store.map_season(league,s).select(['result','player','xG'])) for s in seasons)
+    def league_aggregates_mapped():
+        for s in seasons:
+            aggregates = mfa.LeagueAggregator(mapped[s],matches[s])
+            aggregates.team_table()
+            aggregates.player_table()
+    stages['league_aggregates_mapped'] = lambda: measure(league_aggregates_mapped,repeat,len(seasons))
+    pool = lambda: quiet(mfa.MultiLeagueAnalyzer,leagues,seasons,data_dir)   ## Every league and season, no figure
+    stages['league_pool'] = lambda: measure(pool,repeat,len(leagues) * len(seasons))
+    
+    team_shots = mfa.TeamDataLoader(seasons,team,data_dir).load_team_data()
+    team_compact = mfa.TeamDataLoader(seasons,team,data_dir).load_team_data(compact=True)
+    team_matches = mfa.TeamDataLoader(seasons,team,data_dir).load_team_matches()
+    stages['team_values_shots'] = lambda: measure(lambda: mfa.TeamAnalyzer(team_shots,seasons,team).season_values(),repeat)
+    stages['team_values_compact'] = lambda: measure(lambda: mfa.TeamAnalyzer(team_compact,seasons,team).season_values(),repeat)
+    stages['team_values_matches'] = lambda: measure(lambda: mfa.TeamAnalyzer(team_matches,seasons,team).season_values(),repeat)
+    
+    updater = mfa.DataUpdater.__new__(mfa.DataUpdater)   ## Only the csv export of DataUpdater, without scraping
+    updater.save_dir_path, updater.dir_name = tmp, "Football_Data"
+    os.makedirs(os.path.join(tmp,"Football_Data"),exist_ok=True)
+    season_shots = store.read(league,seasons[-1])
+    stages['csv_league'] = lambda: measure(lambda: updater._DataUpdater__save_csv_file(season_shots.copy(),league,seasons[-1]),repeat)
+    players = mfa.LeagueAggregator(shots[seasons[-1]],matches[seasons[-1]]).player_table()
+    stages['csv_players'] = lambda: measure(lambda: players.sort_values(by=['xG_missed'],ascending=False).to_csv(os.path.join(tmp,"players.csv"),index=False,encoding='utf-8-sig'),repeat)
+    
+    out_dir = os.path.join(tmp,"figures")
+    os.makedirs(out_dir,exist_ok=True)
+    render = lambda job: measure(lambda: quiet(mfa.render_job,job,data_dir,out_dir,['png'],100),repeat)
+    stages['render_league_season'] = lambda: render(('league',league,seasons[-1:]))
+    stages['render_team'] = lambda: render(('team',team,seasons))
+    stages['render_match'] = lambda: render(('match',match[0],match[1],seasons[-1]))
+    
+    results = {}
+    try:
+        for name, stage in stages.items():
+            if only and name not in only:
+                continue
+            results[name] = stage()
+            print("{:<26} {:10.2f} ms".format(name,results[name] * 1000))
+    finally:
+        shutil.rmtree(tmp,ignore_errors=True)
+    return results
+
+## Function to compare the results with the limits and with the results of an earlier run
+
+def check(results,thresholds,baseline,tolerance):
+    failed = []
+    for name, seconds in results.items():
+        if name in thresholds and seconds > thresholds[name]:
+            failed.append("{}: {:.2f} ms exceeds the limit of {:.2f} ms".format(name,seconds*1000,thresholds[name]*1000))
+        if baseline is not None and name in baseline and seconds > baseline[name] * (1 + tolerance):
+            failed.append("{}: {:.2f} ms is {:.0f}% slower than the baseline ({:.2f} ms)".format(
+                name,seconds*1000,(seconds/baseline[name] - 1)*100,baseline[name]*1000))
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite of myfootballanalytics")
+    parser.add_argument("--leagues",type=int,default=5)
+    parser.add_argument("--seasons",type=int,default=9)
+    parser.add_argument("--matches",type=int,default=380,help="matches per season")
+    parser.add_argument("--shots",type=int,default=25,help="average shots per match")
+    parser.add_argument("--repeat",type=int,default=3)
+    parser.add_argument("--stage",action="append",help="runs only this stage, may be repeated")
+    parser.add_argument("--data-dir",default=DATA_DIR)
+    parser.add_argument("--pages-dir",default=PAGES_DIR)
+    parser.add_argument("--output",help="saves the results as json")
+    parser.add_argument("--thresholds",default=THRESHOLDS)
+    parser.add_argument("--baseline",help="results of an earlier run (--output) to compare with")
+    parser.add_argument("--tolerance",type=float,default=0.25,help="allowed slowdown against the baseline (default: 0.25)")
+    args = parser.parse_args()
+    
+    scale = {'leagues': args.leagues, 'seasons': args.seasons, 'matches': args.matches, 'shots': args.shots}
+    build_data(scale,args.data_dir)
+    pages = load_pages(args.pages_dir)
+    league = LEAGUES[0]
+    seasons = [str(2014 + j) + "-" + str(2015 + j) for j in range(args.seasons)]
+    last = mfa.ShotStore(args.data_dir).read(league,seasons[-1],columns=['h_team','a_team'])
+    match = (str(last['h_team'].iloc[0]), str(last['a_team'].iloc[0]))
+    team = match[0]
+    
+    results = run_stages(args.data_dir,LEAGUES[:args.leagues],seasons,league,team,match,pages,args.repeat,args.stage)
+    report = {'created': time.strftime("%Y-%m-%dT%H:%M:%S"), 'python': platform.python_version(),
+              'machine': platform.machine(), 'pandas': pd.__version__, 'scale': scale, 'pages': len(pages),
+              'repeat': args.repeat, 'unit': 'seconds', 'results': results}
+    if args.output:
+        with open(args.output,"w") as wf:
+            json.dump(report,wf,indent=1)
+    
+    thresholds = {}
+    if os.path.isfile(args.thresholds):
+        with open(args.thresholds) as rf:
+            thresholds = json.load(rf)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as rf:
+            baseline = json.load(rf)['results']
+    failed = check(results,thresholds,baseline,args.tolerance)
+    if failed:
+        exit("\n".join(failed))
+
+if __name__ == "__main__":
+    main()
@@ -3,5 +3,9 @@ from .mfa import FindIDs
 from .mfa import MatchDataLoader
 from .mfa import MatchAnalyzer
 from .mfa import LeagueAnalyzer
+from .mfa import MultiLeagueAnalyzer
 from .mfa import TeamDataLoader
-from .mfa import TeamAnalyzer
\ No newline at end of file
+from .mfa import TeamAnalyzer
+from .mfa import ReportRenderer
+from .mfa import ShotStore
+from .mfa import QueryServer
\ No newline at end of file
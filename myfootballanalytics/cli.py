@@ -0,0 +1,120 @@
+## Command line interface of myfootballanalytics: replaces editing the flags of 'run.py'
+##
+## Usage:   python -m myfootballanalytics <command> [options]      (python -m myfootballanalytics <command> -h for the options)
+##
+## Only the standard library is imported here; pandas, matplotlib and the rest are loaded by the command that needs them
+
+import argparse
+import os
+from sys import exit
+
+from . import mfa
+
+LEAGUES = ['PremierLeague','Ligue1','Bundesliga','LaLiga','SerieA']
+SEASONS = ['2014-2015','2015-2016','2016-2017','2017-2018','2018-2019','2019-2020','2020-2021','2021-2022','2022-2023']
+
+## Function to run the analysis of a command: figures are saved in 'output_dir' if given, otherwise they are shown
+
+def show_or_save(args,job,analysis,save_players_csv=False):
+    if args.output_dir:
+        os.makedirs(args.output_dir,exist_ok=True)
+        result = mfa.render_job(job,args.dir,args.output_dir,args.format,args.dpi,save_players_csv)
+        if 'error' in result:
+            exit(result['error'])
+        for figure in result['figures']:
+            for path in figure['files']:
+                print(path)
+    else:
+        analysis()
+        mfa.plt.show()
+
+def update_ids(args):
+    mfa.FindIDs(not args.sequential,args.dir,not args.full,replay=args.replay)
+
+def get_data(args):
+    mfa.DataUpdater(args.leagues,args.seasons,args.dir,not args.no_csv,replay=args.replay)
+
+def match(args):
+    def analysis():
+        md = mfa.MatchDataLoader(args.home_team,args.away_team,args.season,args.dir)
+        print(mfa.MatchAnalyzer(md.load_match_data()).analyze_match())
+    show_or_save(args,('match',args.home_team,args.away_team,args.season),analysis)
+
+def league(args):
+    if len(args.leagues) > 1 or args.workers is not None:
+        ## Every league and season in a process pool; figures only with --output-dir
+        mfa.MultiLeagueAnalyzer(args.leagues,args.seasons,args.dir,not args.no_csv,workers=args.workers,
+                                out_dir=args.output_dir,formats=args.format,dpi=args.dpi)
+        return
+    def analysis():
+        mfa.LeagueAnalyzer(args.leagues[0],args.seasons,args.dir,not args.no_csv)
+    show_or_save(args,('league',args.leagues[0],args.seasons),analysis,not args.no_csv)
+
+def team(args):
+    def analysis():
+        td = mfa.TeamDataLoader(args.seasons,args.team,args.dir)
+        mfa.TeamAnalyzer(td.load_team_matches(),args.seasons,args.team).analyze_team()
+    show_or_save(args,('team',args.team,args.seasons),analysis)
+
+def serve(args):
+    mfa.QueryServer(args.dir,host=args.host,port=args.port).serve()
+
+## Function to build the parser of all commands
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="myfootballanalytics",description="Scrape, analyse and visualise football data of https://understat.com/")
+    parser.add_argument("--dir",default=os.getcwd(),help="saving directory (default: current working directory)")
+    commands = parser.add_subparsers(dest="command",metavar="command")
+    commands.required = True
+
+    ## Options shared by the commands that draw figures
+    figures = argparse.ArgumentParser(add_help=False)
+    figures.add_argument("--output-dir",help="saves the figures in this directory instead of showing them")
+    figures.add_argument("--format",action="append",help="figure format when --output-dir is given, may be repeated (default: png)")
+    figures.add_argument("--dpi",type=int,default=100,help="figure resolution when --output-dir is given (default: 100)")
+
+    command = commands.add_parser("update-ids",help="updates the file containing the match ids")
+    command.add_argument("--sequential",action="store_true",help="requests one page at a time")
+    command.add_argument("--full",action="store_true",help="scans all the IDs instead of those after the last known match")
+    command.add_argument("--replay",action="store_true",help="parses again the pages kept in 'Football_Data/pages' without contacting understat")
+    command.set_defaults(run=update_ids)
+
+    command = commands.add_parser("get-data",help="scrapes the shots of the selected leagues and seasons")
+    command.add_argument("--leagues",nargs="+",default=LEAGUES,help="available leagues: " + ", ".join(LEAGUES))
+    command.add_argument("--seasons",nargs="+",default=SEASONS,help="e.g. 2021-2022 2022-2023 (default: 2014-2015 to 2022-2023)")
+    command.add_argument("--no-csv",action="store_true",help="does not save the league's data to csv files")
+    command.add_argument("--replay",action="store_true",help="parses again the pages kept in 'Football_Data/pages' without contacting understat")
+    command.set_defaults(run=get_data)
+
+    command = commands.add_parser("match",parents=[figures],help="plots the shots of a match and prints a table with information")
+    command.add_argument("home_team")
+    command.add_argument("away_team")
+    command.add_argument("season",help="e.g. 2022-2023")
+    command.set_defaults(run=match)
+
+    command = commands.add_parser("league",parents=[figures],help="plots the xG figures of the teams of one or more leagues")
+    command.add_argument("leagues",nargs="+",metavar="league",help="available leagues: " + ", ".join(LEAGUES))
+    command.add_argument("--seasons",nargs="+",default=SEASONS,help="e.g. 2021-2022 2022-2023 (default: 2014-2015 to 2022-2023)")
+    command.add_argument("--no-csv",action="store_true",help="does not save the players' data to csv files")
+    command.add_argument("--workers",type=int,help="analyzes the seasons in this many processes (default with several leagues: one per core)")
+    command.set_defaults(run=league)
+
+    command = commands.add_parser("team",parents=[figures],help="plots the xG figures of a team")
+    command.add_argument("team")
+    command.add_argument("--seasons",nargs="+",default=SEASONS,help="e.g. 2021-2022 2022-2023 (default: 2014-2015 to 2022-2023)")
+    command.set_defaults(run=team)
+
+    command = commands.add_parser("serve",help="keeps the data in memory and answers match, team and league queries over HTTP")
+    command.add_argument("--host",default="127.0.0.1")
+    command.add_argument("--port",type=int,default=8000)
+    command.set_defaults(run=serve)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if getattr(args,"format",None) is None:
+        args.format = ['png']
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,1023 @@
-from bs4 import BeautifulSoup
 import concurrent.futures
-import multiprocessing
+import asyncio
+import threading
+import queue
+import collections
+import random
 import json
-import pandas as pd
-import requests
+import re
 import os
-import math
 import datetime
 import time
-from tqdm.notebook import tqdm as tqdm_nb
 from sys import exit
-import shutil
-import matplotlib.pyplot as plt
-from mplsoccer.pitch import Pitch
-import numpy as np
+import hashlib
+import gzip
+import tracemalloc
 import statistics
+import warnings
+import contextlib
+import io
+import http.server
+import urllib.parse
+import importlib
 #from understatapi import UnderstatClient
 
 ## Author: Ilias Samathrakis
 
+## Class to import a module only when one of its attributes is used for the first time: 'import myfootballanalytics'
+## stays fast and every command loads only the libraries it needs
+
+class LazyModule:
+    def __init__(self,name):
+        self.name = name
+        self.module = None
+    
+    def __getattr__(self,attr):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module,attr)
+
+bs4 = LazyModule("bs4")
+aiohttp = LazyModule("aiohttp")
+pd = LazyModule("pandas")
+np = LazyModule("numpy")
+pyarrow = LazyModule("pyarrow")
+pq = LazyModule("pyarrow.parquet")
+tqdm_notebook = LazyModule("tqdm.notebook")
+plt = LazyModule("matplotlib.pyplot")
+mpl_figure = LazyModule("matplotlib.figure")
+backend_agg = LazyModule("matplotlib.backends.backend_agg")
+mplsoccer_pitch = LazyModule("mplsoccer.pitch")
+
+## Class to limit the number of requests per second (token bucket)
+
+class TokenBucket:
+    def __init__(self,rate,capacity=1):
+        self.rate = rate            ## Tokens added per second. None or 0 disables the limit
+        self.capacity = capacity    ## Maximum burst size
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    async def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+## Class to keep the raw pages from https://understat.com/ on disk (gzip files named by the hash of their content)
+
+class PageCache:
+    def __init__(self,save_dir_path=os.getcwd()):
+        self.path = os.path.join(save_dir_path,"Football_Data","pages")
+        self.index_file = os.path.join(self.path,"index.json")   ## match_id -> content hash
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.isfile(self.index_file):
+            with open(self.index_file,'r') as rf:
+                self.entries = json.load(rf)
+    
+    def __object(self,content_hash):
+        return os.path.join(self.path,"objects",content_hash[:2],content_hash + ".gz")
+    
+    def get(self,match_id):
+        content_hash = self.entries.get(str(match_id))
+        if content_hash is None or not os.path.isfile(self.__object(content_hash)):
+            return None
+        with open(self.__object(content_hash),'rb') as rf:
+            return gzip.decompress(rf.read())
+    
+    def put(self,match_id,content):
+        ## Identical pages are stored once
+        content_hash = hashlib.sha256(content).hexdigest()
+        path = self.__object(content_hash)
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp",'wb') as wf:
+                wf.write(gzip.compress(content))
+            os.replace(path + ".tmp",path)
+        with self.lock:
+            self.entries[str(match_id)] = content_hash
+    
+    def ids(self):
+        return [int(match_id) for match_id in self.entries]
+    
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        with self.lock:
+            with open(self.index_file + ".tmp",'w') as wf:
+                json.dump(self.entries,wf)
+        os.replace(self.index_file + ".tmp",self.index_file)
+
+## Class to download pages from https://understat.com/ over a shared keep-alive connection pool
+
+class PageFetcher:
+    def __init__(self,base_url="https://understat.com/match/",concurrency=16,rate=20,retries=3,backoff=0.5,timeout=30,cache=None,replay=False):
+        self.base_url = base_url
+        self.cache = cache     ## PageCache that keeps every downloaded page
+        self.replay = replay   ## Serves the pages from 'cache' only, without any request
+        self.concurrency = concurrency   ## Maximum number of requests in flight
+        self.rate = rate                 ## Maximum number of requests per second
+        self.retries = retries
+        self.backoff = backoff           ## Seconds before the first retry, doubled on every further attempt
+        self.timeout = timeout
+    
+    async def __get(self,session,bucket,match_id):
+        if self.replay:
+            return self.cache.get(match_id)
+        content = await self.__download(session,bucket,match_id)
+        if content is not None and self.cache is not None:
+            await asyncio.to_thread(self.cache.put,match_id,content)
+        return content
+    
+    async def __download(self,session,bucket,match_id):
+        url = self.base_url + str(match_id)
+        for attempt in range(self.retries + 1):
+            await bucket.acquire()
+            try:
+                async with session.get(url) as res:
+                    if res.status == 429 or res.status >= 500:   ## Only these statuses are worth another attempt
+                        raise aiohttp.ClientResponseError(res.request_info, res.history, status=res.status)
+                    if res.status >= 400:   ## 404 (no such match), 403...
+                        return None
+                    return await res.read()
+            except (aiohttp.ClientResponseError, aiohttp.ClientConnectionError, asyncio.TimeoutError):   ## 429, 5xx, network
+                if attempt == self.retries:
+                    return None
+                await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            except aiohttp.ClientError:   ## e.g. a malformed response: not retried
+                return None
+    
+    async def __worker(self,session,bucket,jobs,sink):
+        ## Each worker hands its page to 'sink' before taking the next ID, so at most 'concurrency' pages are held
+        while True:
+            try:
+                i, match_id = jobs.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            content = await self.__get(session,bucket,match_id)
+            await sink(i,content)
+    
+    async def __get_all(self,match_ids,sink):
+        jobs = asyncio.Queue()
+        for i in range(len(match_ids)):
+            jobs.put_nowait((i,match_ids[i]))
+        bucket = TokenBucket(self.rate, self.concurrency)
+        if self.replay:
+            workers = [self.__worker(None,bucket,jobs,sink) for _ in range(min(self.concurrency,len(match_ids)))]
+            await asyncio.gather(*workers)
+            return
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=30)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            workers = [self.__worker(session,bucket,jobs,sink) for _ in range(min(self.concurrency,len(match_ids)))]
+            await asyncio.gather(*workers)
+    
+    def __run(self,coro):
+        ## Jupyter already runs an event loop, in which case the requests run on a separate thread
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coro)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coro).result()
+    
+    def __save_cache(self):
+        if self.cache is not None and not self.replay:
+            self.cache.save()
+    
+    def fetch_all(self,match_ids,parse=None,desc=None):
+        ## Returns the page (or parse(page)) of every ID in the order of 'match_ids'. Failed requests give None
+        match_ids = list(match_ids)
+        results = [None] * len(match_ids)
+        progress = tqdm_notebook.tqdm(total=len(match_ids),desc=desc,leave=False) if desc is not None else None
+        
+        async def sink(i,content):
+            if content is not None and parse is not None:
+                content = parse(content)
+            results[i] = content
+            if progress is not None:
+                progress.update(1)
+        
+        try:
+            self.__run(self.__get_all(match_ids,sink))
+        finally:
+            self.__save_cache()
+        if progress is not None:
+            progress.close()
+        return results
+    
+    def fetch_each(self,match_ids,callback):
+        ## Calls callback(i, page) for every ID as soon as it arrives. A blocking callback pauses the downloads
+        async def sink(i,content):
+            await asyncio.to_thread(callback,i,content)
+        
+        try:
+            self.__run(self.__get_all(list(match_ids),sink))
+        finally:
+            self.__save_cache()
+
+## Function to pull the shotsData JSON out of the raw bytes of an understat page (no HTML tree is built)
+
+SHOTS_DATA = re.compile(rb"shotsData\s*=\s*JSON\.parse\('(.*?)'\)",re.DOTALL)
+
+def extract_shots_data(content):
+    if isinstance(content,str):
+        content = content.encode('utf8')
+    match = SHOTS_DATA.search(content)
+    if match is None:
+        return None
+    try:
+        return json.loads(match.group(1).decode('unicode_escape'))
+    except ValueError:
+        return None
+
+## Function to extract the shots of a match from an understat page
+
+def parse_match_page(content,index=1,fast=True):
+    if fast and index == 1:
+        data = extract_shots_data(content)
+        if data is not None:
+            return data
+    try:   ## Fallback: full HTML parse, for pages whose layout the extractor does not recognise
+        soup = bs4.BeautifulSoup(content,"lxml")
+        scripts = soup.find_all("script")
+        strings = scripts[index].string
+        ind_start = strings.index("('")+2
+        ind_end = strings.index("')")
+        json_data = strings[ind_start:ind_end]
+        json_data = json_data.encode('utf8').decode('unicode_escape')
+        data = json.loads(json_data)
+    except:
+        data = []
+    return data
+
+## Function to turn an understat page into one row per shot with the numeric columns of ShotStore already decoded
+## and validated (runs in the worker processes of DataUpdater, so every page is decoded once, in parallel)
+
+def normalize_match(content):
+    data = parse_match_page(content) if content is not None else []
+    if 'h' not in data and 'a' not in data:
+        return None
+    records = (data['h'] if 'h' in data else []) + (data['a'] if 'a' in data else [])
+    if len(records) == 0:   ## Match not played yet
+        return pd.DataFrame()
+    try:
+        return ShotStore.decode_records(records)
+    except ValueError as error:
+        raise ValueError("Match " + str(records[0].get('match_id')) + ": " + str(error))
+
+## Function to find the team of the shooter and its opponent (two categorical columns sharing the same teams)
+
+def shooting_teams(data):
+    h_team = data['h_team'].astype(str)
+    a_team = data['a_team'].astype(str)
+    teams = pd.CategoricalDtype(sorted(set(h_team.unique()) | set(a_team.unique())))
+    h_codes = pd.Categorical(h_team,dtype=teams).codes
+    a_codes = pd.Categorical(a_team,dtype=teams).codes
+    home = (data['h_a'] == 'h').to_numpy()
+    team = pd.Categorical.from_codes(np.where(home,h_codes,a_codes),dtype=teams)
+    opponent = pd.Categorical.from_codes(np.where(home,a_codes,h_codes),dtype=teams)
+    return team, opponent
+
+## Function to add the 'For'/'Against' view of the shots. 'important_team' is the team of the shooter for the 'For' rows
+## and its opponent for the 'Against' copy. With against=False only the 'For' rows are returned (no copy of the frame)
+
+def mirror_shots(data,against=True):
+    data = as_pandas(data)
+    if 'team' in data.columns and 'opponent' in data.columns:   ## Derived columns of ShotStore
+        team, opponent = data['team'].astype('category'), data['opponent'].astype('category')
+        teams = sorted(set(team.cat.categories) | set(opponent.cat.categories))
+        team, opponent = team.cat.set_categories(teams).values, opponent.cat.set_categories(teams).values
+    else:
+        team, opponent = shooting_teams(data)
+    sides = pd.CategoricalDtype(['For','Against'])
+    
+    result = data.assign(important_team=team,opponent=opponent)
+    result['F/A'] = pd.Categorical.from_codes(np.zeros(len(data),dtype='int8'),dtype=sides)
+    if not against:
+        return result
+    part = data.assign(important_team=opponent,opponent=team)
+    part['F/A'] = pd.Categorical.from_codes(np.ones(len(data),dtype='int8'),dtype=sides)
+    return pd.concat([result,part],ignore_index=True)
+
+## Class to keep track of the stored matches (file, fetch time and content hash per understat match_id)
+
+class MatchManifest:
+    def __init__(self,path):
+        self.path = path
+        self.entries = {}
+        if os.path.isfile(self.path):
+            with open(self.path,'r') as rf:
+                self.entries = json.load(rf)
+    
+    def get(self,match_id):
+        return self.entries.get(str(match_id))
+    
+    def add(self,match_id,league,season,file,content_hash,kickoff,fetched=None):
+        if fetched is None:
+            fetched = datetime.datetime.now().isoformat(timespec='seconds')
+        self.entries[str(match_id)] = {'league': league, 'season': season, 'file': file, 'fetched': fetched,
+                                       'hash': content_hash, 'kickoff': kickoff}
+    
+    def is_final(self,match_id,refresh_days):
+        ## A match is final once it was fetched more than 'refresh_days' after its kick-off. Without a valid kick-off
+        ## (e.g. a match not played yet) it is fetched again
+        entry = self.get(match_id)
+        if entry is None:
+            return False
+        try:
+            kickoff = datetime.datetime.fromisoformat(entry['kickoff'])
+            fetched = datetime.datetime.fromisoformat(entry['fetched'])
+        except (TypeError, ValueError):
+            return False
+        return fetched - kickoff > datetime.timedelta(days=refresh_days)
+    
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp",'w') as wf:
+            json.dump(self.entries,wf)
+        os.replace(self.path + ".tmp",self.path)
+
+## Class to find where a match is stored: (league, season, home team, away team) -> match_id, file and row groups
+
+class MatchIndex:
+    def __init__(self,path):
+        self.path = path
+        self.entries = {}
+        if os.path.isfile(self.path):
+            with open(self.path,'r') as rf:
+                self.entries = json.load(rf)
+    
+    def find(self,league,season,home_team,away_team):
+        return self.entries.get(league,{}).get(season,{}).get(home_team + "|" + away_team)
+    
+    def update_season(self,league,season,data,file,row_group_size):
+        ## Replaces the entries of one season with the matches of 'data', in the row order of the stored file
+        fixtures = {}
+        rows = data.groupby('match_id',sort=False,observed=True).indices
+        for match_id, positions in rows.items():
+            first, last = int(positions.min()), int(positions.max())
+            key = str(data['h_team'].iloc[first]) + "|" + str(data['a_team'].iloc[first])
+            fixtures[key] = {'match_id': int(match_id), 'file': file,
+                             'row_groups': list(range(first // row_group_size, last // row_group_size + 1))}
+        self.entries.setdefault(league,{})[season] = fixtures
+    
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp = self.path + ".tmp" + str(os.getpid()) + "." + str(threading.get_ident())   ## Several writers may save at once
+        with open(temp,'w') as wf:
+            json.dump(self.entries,wf)
+        os.replace(temp,self.path)
+
+## Class to keep the recently loaded seasons in memory, shared by all loaders of the process (least recently used
+## seasons are dropped first once 'budget_mb' is exceeded; a season is read again when its file changes)
+
+class SeasonCache:
+    def __init__(self,budget_mb=512):
+        self.budget_mb = budget_mb
+        self.tables = collections.OrderedDict()   ## file path -> (file signature, arrow table)
+        self.lock = threading.Lock()
+    
+    def __signature(self,path):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def __size(self):
+        return sum(table.nbytes for _, table in self.tables.values())
+    
+    def peek(self,path):
+        ## The cached table of 'path', or None if it is not cached or out of date
+        signature = self.__signature(path) if os.path.isfile(path) else None
+        with self.lock:
+            item = self.tables.get(path)
+            if item is None or item[0] != signature:
+                return None
+            self.tables.move_to_end(path)
+            return item[1]
+    
+    def get(self,path):
+        table = self.peek(path)
+        if table is not None:
+            return table
+        signature = self.__signature(path)
+        table = pq.read_table(path)
+        with self.lock:
+            self.tables.pop(path,None)
+            if table.nbytes <= self.budget_mb * 2**20:
+                self.tables[path] = (signature, table)
+                while self.__size() > self.budget_mb * 2**20:
+                    self.tables.popitem(last=False)
+        return table
+    
+    def invalidate(self,path=None):
+        with self.lock:
+            if path is None:
+                self.tables.clear()
+            else:
+                self.tables.pop(path,None)
+
+season_cache = SeasonCache()
+
+## Class to hold shots in NumPy arrays: numeric columns as they are, text columns as integer codes into dictionaries
+## shared by the columns of the same kind (one list of teams for h_team, a_team, team and opponent, one of players...)
+
+class ShotTable:
+    domains = {'h_team': 'team', 'a_team': 'team', 'team': 'team', 'opponent': 'team', 'important_team': 'team',
+               'player': 'player', 'player_assisted': 'player'}
+    
+    def __init__(self,columns,dictionaries):
+        self.columns = columns             ## name -> array (codes for the text columns, -1 if missing)
+        self.dictionaries = dictionaries   ## domain -> sorted array of names
+    
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if len(self.columns) > 0 else 0
+    
+    def dictionary(self,name):
+        ## The names behind the codes of column 'name', or None for a numeric column
+        return self.dictionaries.get(self.domains.get(name,name))
+    
+    @property
+    def nbytes(self):
+        return sum(v.nbytes for v in self.columns.values()) + sum(sum(len(n) for n in d) for d in self.dictionaries.values())
+    
+    @classmethod
+    def from_pandas(cls,data):
+        coded = {}
+        for c in data.columns:
+            if not pd.api.types.is_numeric_dtype(data[c].dtype) and not pd.api.types.is_bool_dtype(data[c].dtype):
+                coded.setdefault(cls.domains.get(c,c),[]).append((c,data[c].astype('category')))
+        dictionaries = {}
+        for domain, items in coded.items():
+            dictionaries[domain] = np.array(sorted(set().union(*[set(v.cat.categories) for _, v in items])),dtype=object)
+        columns = {}
+        for c in data.columns:
+            domain = cls.domains.get(c,c)
+            if domain not in dictionaries:
+                columns[c] = data[c].to_numpy()
+                continue
+            values = dict(coded[domain])[c]
+            dictionary = dictionaries[domain]
+            mapping = np.searchsorted(dictionary,np.array(values.cat.categories,dtype=object))
+            codes = values.cat.codes.to_numpy()
+            dtype = 'int8' if len(dictionary) < 2**7 else 'int16' if len(dictionary) < 2**15 else 'int32'
+            columns[c] = np.where(codes >= 0,mapping[codes] if len(mapping) > 0 else -1,-1).astype(dtype)
+        return cls(columns,dictionaries)
+    
+    def to_pandas(self,columns=None):
+        data = {}
+        for c in (columns if columns is not None else self.columns.keys()):
+            dictionary = self.dictionary(c)
+            if dictionary is None:
+                data[c] = self.columns[c]
+            else:
+                data[c] = pd.Categorical.from_codes(self.columns[c],categories=dictionary)
+        return pd.DataFrame(data)
+    
+    def code(self,name,value):
+        ## Code of 'value' in column 'name'; -2 (matching no row) if the value is unknown
+        dictionary = self.dictionary(name)
+        i = int(np.searchsorted(dictionary,value))
+        return i if i < len(dictionary) and dictionary[i] == value else -2
+    
+    def values(self,name):
+        dictionary = self.dictionary(name)
+        if dictionary is None:
+            return self.columns[name]
+        codes = self.columns[name]
+        return np.where(codes >= 0,dictionary[np.maximum(codes,0)] if len(dictionary) > 0 else None,None)
+    
+    def mask(self,name,values):
+        ## Rows whose column 'name' holds one of 'values'
+        values = list(values) if isinstance(values,(list,tuple,set)) else [values]
+        if self.dictionary(name) is not None:
+            values = [self.code(name,v) for v in values]
+        return np.isin(self.columns[name],values)
+    
+    def filter(self,mask):
+        return ShotTable(dict((c, v[mask]) for c, v in self.columns.items()),self.dictionaries)
+    
+    def select(self,columns):
+        return ShotTable(dict((c, self.columns[c]) for c in columns),self.dictionaries)
+    
+    def where(self,filters):
+        ## Rows matching 'filters' in the pyarrow syntax of ShotStore.read: [(column, op, value), ...] or a list of such
+        ## lists (any of them). op: '==', '!=', 'in', 'not in', '<', '<=', '>', '>='
+        if filters is None or len(self) == 0:
+            return self
+        groups = filters if isinstance(filters[0],list) else [filters]
+        mask = np.zeros(len(self),dtype=bool)
+        for group in groups:
+            selected = np.ones(len(self),dtype=bool)
+            for name, op, value in group:
+                if op in ('==','in'):
+                    selected &= self.mask(name,value)
+                elif op in ('!=','not in'):
+                    selected &= ~self.mask(name,value)
+                else:
+                    values = self.values(name)
+                    selected &= {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal}[op](values,value)
+            mask |= selected
+        return self.filter(mask)
+    
+    @staticmethod
+    def concat(tables):
+        ## One table with the rows of all 'tables' (their dictionaries are merged, the codes translated)
+        tables = [t for t in tables if len(t.columns) > 0]
+        if len(tables) == 1:
+            return tables[0]
+        if len(tables) == 0:
+            return ShotTable({},{})
+        domains = set().union(*[t.dictionaries.keys() for t in tables])
+        dictionaries = dict((d, np.array(sorted(set().union(*[set(t.dictionaries.get(d,[])) for t in tables])),dtype=object)) for d in domains)
+        columns = {}
+        for c in tables[0].columns.keys():
+            domain = ShotTable.domains.get(c,c)
+            if domain not in dictionaries:
+                columns[c] = np.concatenate([t.columns[c] for t in tables])
+                continue
+            dictionary = dictionaries[domain]
+            dtype = 'int8' if len(dictionary) < 2**7 else 'int16' if len(dictionary) < 2**15 else 'int32'
+            parts = []
+            for t in tables:
+                mapping = np.searchsorted(dictionary,t.dictionary(c)) if len(t.dictionary(c)) > 0 else np.zeros(1,dtype='int64')
+                codes = np.asarray(t.columns[c])
+                parts.append(np.where(codes >= 0,mapping[np.maximum(codes,0)],-1).astype(dtype))
+            columns[c] = np.concatenate(parts)
+        return ShotTable(columns,dictionaries)
+    
+    def group_sum(self,keys,values):
+        ## Sums per distinct combination of the 'keys' columns. 'values': name -> array with one value per row
+        ## (booleans and integers give integer sums). Returns a pandas frame with the keys, the sums and 'count'
+        if len(self) == 0:
+            return pd.DataFrame(columns=list(keys) + list(values.keys()) + ['count'])
+        levels, group = [], np.zeros(len(self),dtype='int64')
+        for k in keys:   ## One integer per combination of the keys (mixed radix of the distinct values of each key)
+            level, position = np.unique(self.columns[k],return_inverse=True)
+            levels.append(level)
+            group = group * len(level) + position.ravel()
+        groups, inverse = np.unique(group,return_inverse=True)
+        inverse, n = inverse.ravel(), len(groups)
+        columns = {}
+        for k, level in reversed(list(zip(keys,levels))):
+            groups, position = np.divmod(groups,len(level))
+            dictionary = self.dictionary(k)
+            columns[k] = level[position] if dictionary is None else pd.Categorical.from_codes(level[position],categories=dictionary)
+        result = dict((k, columns[k]) for k in keys)
+        for name, array in values.items():
+            array = np.asarray(array)
+            sums = np.bincount(inverse,weights=array.astype(float),minlength=n)
+            result[name] = sums if array.dtype.kind == 'f' else np.rint(sums).astype('int64')
+        result['count'] = np.bincount(inverse,minlength=n)
+        return pd.DataFrame(result)
+    
+    def mirror(self):
+        ## The 'For'/'Against' view of mirror_shots: the copy swaps 'important_team' and 'opponent'; only the codes
+        ## are doubled, the names are not
+        team, opponent = self.columns['team'], self.columns['opponent']
+        columns = dict((c, np.concatenate([v,v])) for c, v in self.columns.items())
+        columns['important_team'] = np.concatenate([team,opponent])
+        columns['opponent'] = np.concatenate([opponent,team])
+        columns['F/A'] = np.repeat(np.array([1,0],dtype='int8'),len(self))
+        return ShotTable(columns,dict(self.dictionaries,**{'F/A': np.array(['Against','For'],dtype=object)}))
+
+## Function to give pandas data to the code written for pandas frames
+
+def as_pandas(data):
+    return data.to_pandas() if isinstance(data,ShotTable) else data
+
+## Function to convert stored float32 values (such as xG) to float64 through their shortest decimal form: 0.911 stays
+## 0.911 in the sums and the saved tables instead of 0.9110000133514404
+
+def as_float64(values):
+    values = np.asarray(values)
+    return values.astype(str).astype(float) if values.dtype == np.float32 else values.astype(float)
+
+## Class to store the shots in typed columnar files (one parquet file per league and season)
+
+class ShotStore:
+    float_columns = ['X','Y','xG']
+    int_columns = {'id': 'int64', 'minute': 'int16', 'player_id': 'int32', 'season': 'int16',
+                   'match_id': 'int32', 'h_goals': 'int16', 'a_goals': 'int16'}
+    category_columns = ['result','player','h_a','situation','shotType','player_assisted','lastAction','date']
+    required_columns = ['id','minute','result','X','Y','xG','player','h_a','situation','season','match_id',
+                        'h_team','a_team','h_goals','a_goals']
+    derived_columns = ['team','opponent','distance','angle','in_box','big_chance','Xmod','Ymod']
+    derived_version = 1   ## Increase when 'derive' changes: stored seasons of an older version are derived again on reading
+    lock = threading.Lock()
+    index_lock = threading.Lock()   ## The match index is read, updated and saved by one thread at a time
+    
+    def __init__(self,save_dir_path=os.getcwd()):
+        self.save_dir_path = save_dir_path
+        self.dir_name = "Football_Data"
+        self.store_name = "shots"
+        self.columns_name = "columns"   ## Seasons exported as one .npy file per column, see map_season
+        self.index_file = "match_index.json"
+        self.row_group_size = 2000
+    
+    def relpath(self,league,season):
+        return os.path.join(self.store_name, league, season + ".parquet")
+    
+    def path(self,league,season):
+        return os.path.join(self.save_dir_path, self.dir_name, self.relpath(league,season))
+    
+    def exists(self,league,season):
+        return os.path.isfile(self.path(league,season))
+    
+    @staticmethod
+    def decode(data):
+        ## Converts the strings of understat to float32, integer and categorical columns
+        data = data.reset_index(drop=True)
+        if 'index' in data.columns:
+            data = data.drop(columns=['index'])
+        for c in ShotStore.float_columns:
+            if c in data.columns:
+                data[c] = pd.to_numeric(data[c]).astype('float32')
+        for c, dtype in ShotStore.int_columns.items():
+            if c in data.columns:
+                data[c] = pd.to_numeric(data[c]).astype(dtype)
+        for c in ShotStore.category_columns:
+            if c in data.columns:
+                data[c] = data[c].astype('category')
+        if 'h_team' in data.columns and 'a_team' in data.columns:
+            teams = pd.CategoricalDtype(sorted(set(data['h_team'].astype(str)) | set(data['a_team'].astype(str))))
+            data['h_team'] = data['h_team'].astype(str).astype(teams)
+            data['a_team'] = data['a_team'].astype(str).astype(teams)
+        return data
+    
+    @staticmethod
+    def decode_records(records):
+        ## Builds the shots of one match straight from the records of understat: float and integer columns as in
+        ## 'decode' (the categorical columns are built once per season, by 'write'), checked by 'validate'
+        names = list(dict.fromkeys(c for r in records for c in r.keys()))
+        columns = dict((c, [r.get(c) for r in records]) for c in names)
+        try:
+            for c in ShotStore.float_columns:
+                if c in columns:
+                    columns[c] = np.array(columns[c],dtype='float32')
+            for c, dtype in ShotStore.int_columns.items():
+                if c in columns:
+                    columns[c] = np.array(columns[c]).astype(dtype)
+        except (TypeError, ValueError):
+            raise ValueError("non numeric values in '" + c + "'")
+        ShotStore.validate(columns)
+        return pd.DataFrame(columns)
+    
+    @staticmethod
+    def validate(columns):
+        ## Checks the decoded columns of a match (name -> values): required columns present and filled, coordinates and xG
+        ## within [0, 1], no negative minute or score, h_a either 'h' or 'a'. Raises ValueError otherwise
+        missing = [c for c in ShotStore.required_columns if c not in columns]
+        if len(missing) > 0:
+            raise ValueError("missing columns " + ", ".join(missing))
+        for c in ShotStore.float_columns:
+            values = np.asarray(columns[c],dtype='float32')
+            if np.isnan(values).any():
+                raise ValueError("missing values in '" + c + "'")
+            if (values < 0).any() or (values > 1).any():
+                raise ValueError("'" + c + "' outside [0, 1]")
+        for c in ['minute','h_goals','a_goals']:
+            if (np.asarray(columns[c]) < 0).any():
+                raise ValueError("negative '" + c + "'")
+        for c in ['result','player','situation','h_team','a_team']:
+            if any(v is None or v == "" for v in columns[c]):
+                raise ValueError("missing values in '" + c + "'")
+        if not set(columns['h_a']) <= {'h','a'}:
+            raise ValueError("'h_a' other than 'h' or 'a'")
+    
+    @staticmethod
+    def derive(data):
+        ## Features of every shot, from the point of view of the shooter: its team and opponent, distance to goal
+        ## (122 x 40 pitch), angle between the posts in degrees, shot within the penalty area, big chance (xG >= 0.4)
+        ## and the coordinates on the pitch of MatchAnalyzer with the home team attacking to the right (Xmod, Ymod)
+        pitch_x, pitch_y = PitchTemplate.pitch_x, PitchTemplate.pitch_y
+        home = (data['h_a'] == 'h').to_numpy()
+        X, Y = data['X'].to_numpy(dtype='float32'), data['Y'].to_numpy(dtype='float32')
+        team, opponent = shooting_teams(data)
+        distance = np.sqrt((122-X.astype(float)*122)**2+(40-Y.astype(float)*40)**2)
+        x, y = (1-X.astype(float))*pitch_x, (Y.astype(float)-0.5)*pitch_y   ## From the centre of the goal line
+        angle = np.degrees(np.arctan2(7.32*x,x**2+y**2-3.66**2))
+        in_box = np.where(home,(X*pitch_x >= pitch_x-16.5) & (Y*pitch_y >= 15.0) & (Y*pitch_y <= 55.00),
+                          ((1-X)*pitch_x <= 16.5) & ((1-Y)*pitch_y >= 15.0) & ((1-Y)*pitch_y <= 55.00))
+        return data.assign(team=team,opponent=opponent,distance=distance.astype('float32'),angle=angle.astype('float32'),
+                           in_box=in_box,big_chance=(data['xG'] >= 0.4).to_numpy(),
+                           Xmod=np.where(home,X*pitch_x,(1-X)*pitch_x),Ymod=np.where(home,Y*pitch_y,(1-Y)*pitch_y))
+    
+    def __save(self,data,filename):
+        ## Writes decoded shots with their derived columns, tagged with 'derived_version'. Returns the written data
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        data = self.derive(data)
+        table = pyarrow.Table.from_pandas(data,preserve_index=False)
+        table = table.replace_schema_metadata(dict(table.schema.metadata or {}, derived_version=str(self.derived_version)))
+        pq.write_table(table,filename + ".tmp",row_group_size=self.row_group_size)
+        os.replace(filename + ".tmp",filename)
+        season_cache.invalidate(filename)
+        return data
+    
+    def __current(self,schema):
+        return (schema.metadata or {}).get(b'derived_version') == str(self.derived_version).encode()
+    
+    def __table(self,filename):
+        ## The stored table of a season. Files written by an older version get their derived columns computed first
+        table = season_cache.get(filename)
+        if self.__current(table.schema):
+            return table
+        with self.lock:
+            table = season_cache.get(filename)
+            if not self.__current(table.schema):
+                self.__save(self.decode(table.drop_columns([c for c in self.derived_columns if c in table.column_names]).to_pandas()),filename)
+                table = season_cache.get(filename)
+        return table
+    
+    def write(self,data,league,season):
+        ## Returns the stored data: decoded, with the derived columns
+        data = self.__save(self.decode(data),self.path(league,season))
+        self.update_index(league,season,data)
+        return data
+    
+    def columns_dir(self,league,season):
+        return os.path.join(self.save_dir_path, self.dir_name, self.columns_name, league, season)
+    
+    def __source(self,league,season):
+        stat = os.stat(self.path(league,season))
+        return [stat.st_mtime_ns, stat.st_size, self.derived_version]
+    
+    def export_columns(self,league,season):
+        ## Writes the columns of a stored season as .npy files (codes for the text columns) with a json file holding the
+        ## dictionaries and the version of the season file they come from
+        table = ShotTable.from_pandas(self.read(league,season))
+        source = self.__source(league,season)
+        directory = self.columns_dir(league,season)
+        os.makedirs(directory, exist_ok=True)
+        suffix = ".tmp" + str(os.getpid())   ## Several processes may export the same season at once
+        for c, values in table.columns.items():
+            filename = os.path.join(directory, c + ".npy")
+            with open(filename + suffix,'wb') as wf:
+                np.save(wf,values)
+            os.replace(filename + suffix,filename)
+        meta = {'source': source, 'columns': list(table.columns.keys()),
+                'dictionaries': dict((d, [str(v) for v in values]) for d, values in table.dictionaries.items())}
+        filename = os.path.join(directory, "columns.json")
+        with open(filename + suffix,'w') as wf:
+            json.dump(meta,wf)
+        os.replace(filename + suffix,filename)   ## Written last: the export is complete once it is there
+        return meta
+    
+    def map_season(self,league,season):
+        ## ShotTable of a stored season whose columns are read-only memory maps: processes mapping the same season share
+        ## one copy in the page cache and nothing is parsed. The columns are exported first if missing or out of date
+        if not self.exists(league,season) and not self.import_json(league,season):
+            return ShotTable({},{})
+        filename = os.path.join(self.columns_dir(league,season), "columns.json")
+        meta = None
+        if os.path.isfile(filename):
+            with open(filename,'r') as rf:
+                meta = json.load(rf)
+        if meta is None or meta['source'] != self.__source(league,season):
+            self.read(league,season,columns=['match_id'])   ## Files of an older version are derived again first
+            meta = self.export_columns(league,season)
+        directory = self.columns_dir(league,season)
+        columns = dict((c, np.load(os.path.join(directory, c + ".npy"),mmap_mode='r')) for c in meta['columns'])
+        dictionaries = dict((d, np.array(values,dtype=object)) for d, values in meta['dictionaries'].items())
+        return ShotTable(columns,dictionaries)
+    
+    def upgrade(self):
+        ## Computes the derived columns of every stored season of an older version. Returns the files rewritten
+        root = os.path.join(self.save_dir_path, self.dir_name, self.store_name)
+        upgraded = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            for f in sorted(filenames):
+                filename = os.path.join(dirpath,f)
+                if f.endswith(".parquet") and not self.__current(pq.read_schema(filename)):
+                    self.__table(filename)
+                    season_cache.invalidate(filename)
+                    upgraded.append(filename)
+        return upgraded
+    
+    def index(self):
+        return MatchIndex(os.path.join(self.save_dir_path, self.dir_name, self.index_file))
+    
+    def update_index(self,league,season,data):
+        with self.index_lock:
+            index = self.index()
+            index.update_season(league,season,data,self.relpath(league,season),self.row_group_size)
+            index.save()
+    
+    def import_json(self,league,season):
+        ## Converts the per-match json files of older versions into the store. Returns False if there are none
+        path = os.path.join(self.save_dir_path, self.dir_name, league, season)
+        if not os.path.isdir(path):
+            return False
+        files = [f for f in os.listdir(path) if f.endswith('.json')]
+        frames = []
+        for i in range(len(files)):
+            df = pd.read_json(os.path.join(path,files[i]),dtype=False,convert_dates=False)
+            if len(df) > 0:
+                frames.append(df)
+        if len(frames) == 0:
+            return False
+        frames.sort(key=lambda df: int(df['match_id'].iloc[0]))
+        self.write(pd.concat(frames),league,season)
+        return True
+    
+    def read(self,league,season,columns=None,filters=None):
+        ## Loads only the requested columns and the rows matching 'filters' (pyarrow filter syntax)
+        return self.load(league,[season],columns,filters)
+    
+    def __select(self,table,columns,filters):
+        if filters is not None:
+            table = table.filter(pq.filters_to_expression(filters))
+        if columns is not None:
+            table = table.select(columns)
+        return table
+    
+    def load(self,league,seasons,columns=None,filters=None,report=False,compact=False,mapped=False):
+        ## Loads several seasons at once: the season tables (kept in 'season_cache') are chained by arrow and
+        ## converted to pandas a single time. compact=True returns a ShotTable; mapped=True a ShotTable built from
+        ## the memory-mapped columns of map_season (no copy for a single season without filters)
+        if report:
+            ## A trace already running (started by the caller) is left running: only the growth is counted
+            tracing = tracemalloc.is_tracing()
+            if tracing:
+                traced = tracemalloc.get_traced_memory()[0]
+            else:
+                traced = 0
+                tracemalloc.start()
+            start = time.perf_counter()
+        if mapped:
+            tables = [self.map_season(league,season) for season in seasons]
+            tables = [t.select(columns if columns is not None else list(t.columns.keys())).where(filters) for t in tables if len(t.columns) > 0]
+            compact = True
+        else:
+            tables = []
+        for season in ([] if mapped else seasons):
+            if self.exists(league,season) or self.import_json(league,season):
+                tables.append(self.__select(self.__table(self.path(league,season)),columns,filters))
+        if mapped:
+            data = ShotTable.concat(tables)
+            arrow_bytes = 0
+        elif len(tables) == 0:
+            data = pd.DataFrame()
+            arrow_bytes = 0
+        else:
+            table = pyarrow.concat_tables(tables,promote_options='permissive')
+            arrow_bytes = table.nbytes
+            data = table.to_pandas()
+        if compact and not mapped:
+            data = ShotTable.from_pandas(data)
+        if report:
+            peak = tracemalloc.get_traced_memory()[1] - traced
+            if not tracing:
+                tracemalloc.stop()
+            self.load_report = {'league': league, 'seasons': list(seasons), 'rows': len(data),
+                                'seconds': time.perf_counter() - start,
+                                'memory_mb': (data.nbytes if compact else data.memory_usage(deep=True).sum()) / 2**20,
+                                'peak_mb': (peak + arrow_bytes) / 2**20}
+            print("Loaded {} shots ({} {}) in {:.1f} ms: {:.1f} MB in memory, peak {:.1f} MB".format(
+                self.load_report['rows'],league,", ".join(seasons),self.load_report['seconds']*1000,
+                self.load_report['memory_mb'],self.load_report['peak_mb']))
+        return data
+    
+    def read_match(self,entry,columns=None):
+        ## Reads only the row groups of one match, as given by its MatchIndex entry
+        filename = os.path.join(self.save_dir_path, self.dir_name, entry['file'])
+        if not os.path.isfile(filename):
+            return pd.DataFrame()
+        if columns is not None and 'match_id' not in columns:
+            columns = columns + ['match_id']
+        table = season_cache.peek(filename)
+        parquet_file = pq.ParquetFile(filename) if table is None else None
+        if table is not None or not self.__current(parquet_file.schema_arrow):   ## In memory already, or of an older version
+            return self.__select(self.__table(filename),columns,[('match_id','==',entry['match_id'])]).to_pandas()
+        data = parquet_file.read_row_groups(entry['row_groups'],columns=columns).to_pandas()
+        return data[data['match_id'] == entry['match_id']].reset_index(drop=True)
+
+## Class to store the team aggregates of every league and season: one row per (team, match) and one per (team, season)
+
+class AggregateStore:
+    sums = ['goals_for','goals_ag','shots_for','shots_ag','xG_for','xG_ag','op_shots_for','op_shots_ag',
+            'op_xG_for','op_xG_ag','op_big_for','op_big_ag','op_dist_for','op_dist_ag']   ## op: open play
+    lock = threading.Lock()
+    
+    def __init__(self,save_dir_path=os.getcwd()):
+        self.save_dir_path = save_dir_path
+        self.dir_name = "Football_Data"
+        self.shots = ShotStore(self.save_dir_path)
+    
+    def path(self,table,league,season):
+        ## table: "team_matches" or "team_seasons"
+        return os.path.join(self.save_dir_path, self.dir_name, table, league, season + ".parquet")
+    
+    def __is_current(self,league,season):
+        path = self.path("team_seasons",league,season)
+        if not os.path.isfile(path) or not os.path.isfile(self.path("team_matches",league,season)):
+            return False
+        if not self.shots.exists(league,season):
+            return True
+        return os.path.getmtime(path) >= os.path.getmtime(self.shots.path(league,season))
+    
+    @staticmethod
+    def team_matches(data):
+        ## Per match and side: shots, xG and, for the open-play shots, their number, xG, big chances
+        ## (xG >= 0.4) and summed distance to goal. Each match then gives one row per team
+        data = as_pandas(data)
+        if 'distance' not in data.columns:
+            data = ShotStore.derive(data)
+        xG = data['xG'].to_numpy(dtype=float)
+        open_play = (data['situation'].astype(str) == 'OpenPlay').to_numpy()
+        dist = data['distance'].to_numpy(dtype=float)
+        values = pd.DataFrame({'season': data['season'].to_numpy(), 'match_id': data['match_id'].to_numpy(),
+                               'h_team': data['h_team'].astype(str).to_numpy(), 'a_team': data['a_team'].astype(str).to_numpy(),
+                               'h_goals': data['h_goals'].to_numpy(), 'a_goals': data['a_goals'].to_numpy(),
+                               'h_a': data['h_a'].astype(str).to_numpy(), 'shots': 1, 'xG': xG,
+                               'op_shots': open_play.astype(int), 'op_xG': np.where(open_play,xG,0.0),
+                               'op_big': (open_play & data['big_chance'].to_numpy()).astype(int), 'op_dist': np.where(open_play,dist,0.0)})
+        keys = ['season','match_id','h_team','a_team','h_goals','a_goals']
+        columns = ['shots','xG','op_shots','op_xG','op_big','op_dist']
+        sides = values.groupby(keys + ['h_a'],sort=False)[columns].sum().unstack('h_a',fill_value=0)
+        sides = sides.reindex(columns=pd.MultiIndex.from_product([columns,['h','a']],names=[None,'h_a']),fill_value=0)
+        home, away = sides.xs('h',axis=1,level='h_a'), sides.xs('a',axis=1,level='h_a')
+        matches = sides.index.to_frame(index=False)
+        frames = []
+        for venue, own, other in (('h',home,away),('a',away,home)):
+            rows = pd.DataFrame({'season': matches['season'], 'match_id': matches['match_id'],
+                                 'team': matches['h_team' if venue == 'h' else 'a_team'],
+                                 'opponent': matches['a_team' if venue == 'h' else 'h_team'], 'venue': venue,
+                                 'goals_for': matches['h_goals' if venue == 'h' else 'a_goals'],
+                                 'goals_ag': matches['a_goals' if venue == 'h' else 'h_goals']})
+            for c in columns:
+                rows[c + '_for'] = own[c].to_numpy()
+                rows[c + '_ag'] = other[c].to_numpy()
+            frames.append(rows)
+        result = pd.concat(frames,ignore_index=True).sort_values(['season','match_id','venue'],ascending=[True,True,False],ignore_index=True)
+        teams = pd.CategoricalDtype(sorted(set(result['team'])))
+        result['team'] = result['team'].astype(teams)
+        result['opponent'] = result['opponent'].astype(teams)
+        result['venue'] = result['venue'].astype('category')
+        return result
+    
+    @staticmethod
+    def team_seasons(matches):
+        table = matches.groupby(['season','team'],observed=True)[AggregateStore.sums].sum()
+        table.insert(0,'matches',matches.groupby(['season','team'],observed=True).size())
+        return table.reset_index()
+    
+    def write(self,data,league,season):
+        ## Rebuilds the aggregates of one season from its shots
+        matches = self.team_matches(data)
+        for table, frame in (("team_matches",matches),("team_seasons",self.team_seasons(matches))):
+            filename = self.path(table,league,season)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            frame.to_parquet(filename + ".tmp",engine='pyarrow',index=False)
+            os.replace(filename + ".tmp",filename)
+            season_cache.invalidate(filename)
+    
+    def read(self,table,league,seasons,filters=None):
+        ## Aggregates of several seasons. Seasons stored by an older version (or changed since) are aggregated first
+        tables = []
+        for season in seasons:
+            with self.lock:   ## Readers on several threads (QueryServer) must not rebuild the same season together
+                if not self.__is_current(league,season):
+                    data = self.shots.read(league,season)
+                    if len(data) == 0:
+                        continue
+                    self.write(data,league,season)
+            result = season_cache.get(self.path(table,league,season))
+            if filters is not None:
+                result = result.filter(pq.filters_to_expression(filters))
+            tables.append(result)
+        if len(tables) == 0:
+            return pd.DataFrame()
+        return pyarrow.concat_tables(tables,promote_options='permissive').to_pandas()
+
 ## Class to scrape and save football data from https://understat.com/
 
 class DataUpdater:
-    def __init__(self,leagues,seasons,save_dir_path=os.getcwd(),save_csv_file=False):
+    def __init__(self,leagues,seasons,save_dir_path=os.getcwd(),save_csv_file=False,fetcher=None,workers=None,queue_size=64,refresh_days=2,cache=True,replay=False):
         self.leagues = leagues
         self.seasons = seasons
         self.save_dir_path = save_dir_path
         self.dir_name = "Football_Data"
         self.ids_file = "league_ids.dat"
+        self.manifest_file = "manifest.json"
+        self.store = ShotStore(self.save_dir_path)
+        self.aggregates = AggregateStore(self.save_dir_path)
+        self.refresh_days = refresh_days   ## Matches are fetched again until a fetch happens this many days after kick-off
         self.years = []
         self.save_csv_file = save_csv_file
+        self.replay = replay   ## Parses every match again from the page cache, without any request
+        if self.replay:
+            fetcher = PageFetcher(cache=PageCache(self.save_dir_path),replay=True)
+        elif fetcher is None:
+            fetcher = PageFetcher(concurrency=8,rate=10,cache=PageCache(self.save_dir_path) if cache else None)
+        self.fetcher = fetcher
+        self.workers = workers if workers is not None else os.cpu_count()   ## Parsing processes. 0 parses on a thread
+        self.queue_size = queue_size   ## Maximum number of pages waiting between two stages
         for i in self.seasons:
             self.years.append(int(i[:4]))
         self.update_data()
@@ -55,14 +1043,9 @@ class DataUpdater:
     
     def __create_tree(self):
         os.makedirs(os.path.join(self.save_dir_path, self.dir_name), exist_ok=True)
-        ## Creates directory for each league and year
+        ## Creates the store directory of each league
         for i in range(len(self.leagues)):
-            if not os.path.exists(os.path.join(self.save_dir_path, self.dir_name, self.leagues[i])):
-                os.makedirs(os.path.join(self.save_dir_path, self.dir_name, self.leagues[i]), exist_ok=True)
-            for j in range(len(self.years)):
-                if os.path.exists(os.path.join(self.save_dir_path, self.dir_name, self.leagues[i], str(self.seasons[j]))):
-                    shutil.rmtree(os.path.join(self.save_dir_path, self.dir_name, self.leagues[i], str(self.seasons[j])))
-                os.makedirs(os.path.join(self.save_dir_path, self.dir_name, self.leagues[i], str(self.seasons[j])), exist_ok=True)
+            os.makedirs(os.path.dirname(self.store.path(self.leagues[i],"")), exist_ok=True)
                     
     def __ids(self):
         match_ids = [[] for _ in self.leagues]
@@ -83,96 +1066,225 @@ class DataUpdater:
                     match_ids[self.leagues.index(name)].append(ids)
         return match_ids
     
-    def __check_file(self,league,season,index):
-        filename = os.path.join(self.save_dir_path, self.dir_name, league, season, str(index) + ".dat")
-        return os.path.isfile(filename)
+    def __check_file(self,match_id):
+        ## True if the match is stored and no longer expected to change
+        entry = self.manifest.get(match_id)
+        if entry is None:
+            return False
+        if not os.path.isfile(os.path.join(self.save_dir_path, self.dir_name, entry['file'])):
+            return False
+        return self.manifest.is_final(match_id,self.refresh_days)
     
-    def __scrape_data(self,match_id,index):
-        base_url = "https://understat.com/match/"
-        try:
-            url = base_url + match_id
-            res = requests.get(url)
-            soup = BeautifulSoup(res.content,"lxml")
-            scripts = soup.find_all("script")
-            strings = scripts[index].string
-            ind_start = strings.index("('")+2
-            ind_end = strings.index("')")
-            json_data = strings[ind_start:ind_end]
-            json_data = json_data.encode('utf8').decode('unicode_escape')
-            data = json.loads(json_data)
-        except:
-            data = []
-        return data
+    def __content_hash(self,data):
+        return hashlib.sha256(data.reset_index(drop=True).to_json().encode('utf8')).hexdigest()
+    
+    def __kickoff(self,data):
+        if 'date' not in data.columns or len(data) == 0:
+            return None
+        return str(data['date'].iloc[0])
+    
+    def __import_files(self):
+        ## Moves the per-match json files of older versions into the shot store and registers stored matches
+        ## missing from the manifest, so that they are not downloaded again
+        for i in range(len(self.leagues)):
+            for j in range(len(self.seasons)):
+                league, season = self.leagues[i], self.seasons[j]
+                if not self.store.exists(league,season) and not self.store.import_json(league,season):
+                    continue
+                ids = self.store.read(league,season,columns=['match_id'])['match_id'].unique()
+                if all(self.manifest.get(m) is not None for m in ids):
+                    continue
+                modified = datetime.datetime.fromtimestamp(os.path.getmtime(self.store.path(league,season))).isoformat(timespec='seconds')
+                data = self.store.read(league,season)
+                for match_id, df in data.groupby('match_id',sort=False,observed=True):
+                    if self.manifest.get(match_id) is None:
+                        self.manifest.add(match_id,league,season,self.store.relpath(league,season),
+                                          self.__content_hash(df),self.__kickoff(df),modified)
     
     #def __extract_data_api(self,match_id):
     #    data = UnderstatClient().match(match=str(match_id)).get_shot_data()
     #    return data
     
-    def __create_json_file(self,data,league,season,index):
-        filename = os.path.join(self.save_dir_path, self.dir_name, league, season, str(index) + ".json")
-        data = data.reset_index()
-        data.to_json(filename,indent=4)
+    def __store_match(self,data,match_id,pending):
+        ## Keeps the manifest entry of the match in 'pending' until its season file is written. Returns True if it is
+        ## new or its content changed. A match not played yet (no shot) is not recorded, so that it is fetched again
+        if len(data) == 0:
+            return False
+        content_hash = self.__content_hash(data)
+        entry = self.manifest.get(match_id)
+        changed = entry is None or entry['hash'] != content_hash
+        fetched = entry['fetched'] if self.replay and entry is not None else None   ## A replay downloads nothing
+        pending[match_id] = (content_hash,self.__kickoff(data),fetched)
+        return changed
+    
+    def __record_matches(self,league,season,pending):
+        ## Adds the entries of the matches of a season once the season file holds them
+        for match_id, (content_hash, kickoff, fetched) in pending.items():
+            self.manifest.add(match_id,league,season,self.store.relpath(league,season),content_hash,kickoff,fetched)
         
     def __save_csv_file(self,data,league,season):
-        pitch_x = 95.65
-        pitch_y = 70.00
-
+        ## 'data' comes from the store: Xmod and Ymod are derived columns
         data['league'] = str(league)
 
-        Xmod = data.X.astype('float') * pitch_x
-        Ymod = data.Y.astype('float') * pitch_y
-
-        imp_team = data.h_team
-
-        data['Xmod'] = Xmod.where(data.h_a=="h", other=(1-data.X.astype('float')) * pitch_x)
-        data['Ymod'] = Ymod.where(data.h_a=="h", other=(1-data.Y.astype('float')) * pitch_y)
-
-        data['important_team'] = imp_team.where(data.h_a=='h',other=data.a_team)
-        data['F/A'] = 'For'
-
-        part = data.copy()
-        part['important_team'] = part.apply(lambda x: x['h_team'] if x['important_team'] == x['a_team'] else x['a_team'], axis=1)
-        part['F/A'] = 'Against'
-        result = pd.concat([data, part], ignore_index=True)
+        result = mirror_shots(data)
         
         file_name = league + "_" + season + ".csv"
         result[['result','Xmod','Ymod','xG','player','h_a','situation','season','match_id',
             'h_team','a_team','h_goals','a_goals','important_team','league','F/A']].to_csv(os.path.join(self.save_dir_path,self.dir_name,file_name),encoding='utf-8-sig')
         
     
+    def __fetch_stage(self,jobs,raw_queue,errors):
+        def put(i,content):
+            raw_queue.put((jobs[i],content))
+        try:
+            self.fetcher.fetch_each([job[3] for job in jobs],put) ## scrape data from understat.com
+        except Exception as e:
+            errors.append(e)
+        finally:
+            raw_queue.put(None)
+    
+    def __parse_stage(self,raw_queue,parsed_queue,errors):
+        ## Parses the pages in a process pool, keeping at most two pages per process in flight
+        pending = collections.deque()
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) if self.workers > 0 else None
+        
+        def put(job,parse):
+            try:
+                df = parse()
+            except ValueError as error:   ## Shots rejected by ShotStore.validate: only this match is left out
+                print(str(error))
+                df = None
+            parsed_queue.put((job,df))
+        
+        item = ()
+        try:
+            while True:
+                item = raw_queue.get()
+                if item is None:
+                    break
+                job, content = item
+                if executor is None:
+                    put(job,lambda: normalize_match(content))
+                    continue
+                pending.append((job,executor.submit(normalize_match,content)))
+                if len(pending) >= 2 * self.workers:
+                    job, future = pending.popleft()
+                    put(job,future.result)
+            while len(pending) > 0:
+                job, future = pending.popleft()
+                put(job,future.result)
+        except Exception as e:
+            errors.append(e)
+            while item is not None:   ## Lets the fetcher finish instead of blocking on a full queue
+                item = raw_queue.get()
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            parsed_queue.put(None)
+    
+    def __season_data(self,league,season,match_ids,frames):
+        ## Data of the whole season in the order of 'league_ids.dat': the new matches and the stored copy of the rest
+        stored = self.store.read(league,season) if self.store.exists(league,season) else pd.DataFrame()
+        groups = {}
+        if len(stored) > 0:
+            groups = dict((int(m), df) for m, df in stored.groupby('match_id',sort=False,observed=True))
+        data = []
+        for k in range(len(match_ids)):
+            if frames.get(k) is not None:
+                data.append(frames[k])
+            elif int(match_ids[k]) in groups:
+                data.append(groups[int(match_ids[k])])
+        return data
+    
+    def __finish_season(self,i,j,match_ids,frames,changed):
+        league, season = self.leagues[i], self.seasons[j]
+        file_name = os.path.join(self.save_dir_path,self.dir_name,league + "_" + season + ".csv")
+        store_changed = changed == True or not self.store.exists(league,season)
+        if store_changed:
+            data = self.__season_data(league,season,match_ids,frames)
+            if len(data) == 0:
+                return
+            data = self.store.write(pd.concat(data),league,season)   ## With the derived columns
+            self.aggregates.write(data,league,season)
+        if self.save_csv_file and (store_changed or not os.path.isfile(file_name)):
+            self.__save_csv_file(self.store.read(league,season),league,season)
+    
+    def __write_stage(self,parsed_queue,match_ids,expected,total):
+        ## Single writer: saves every match and the league csv file once all matches of a season are in
+        received = dict((unit,{}) for unit in expected.keys())
+        changed = dict((unit,False) for unit in expected.keys())
+        pending = dict((unit,{}) for unit in expected.keys())   ## Manifest entries of the seasons not yet written
+        progress = tqdm_notebook.tqdm(total=total,desc='Matches',leave=False)
+        while True:
+            item = parsed_queue.get()
+            if item is None:
+                break
+            (i, j, k, match_id), df = item
+            progress.update(1)
+            frames = received[(i,j)]
+            frames[k] = None
+            if df is not None:   ## Numeric columns decoded and validated by normalize_match
+                frames[k] = df   ## Kept even if unchanged, in case the stored season file has to be rebuilt
+                if self.__store_match(df,match_id,pending[(i,j)]):
+                    changed[(i,j)] = True
+            if len(frames) == expected[(i,j)]:
+                self.__finish_season(i,j,match_ids[i][j],frames,changed[(i,j)])
+                self.__record_matches(self.leagues[i],self.seasons[j],pending.pop((i,j)))
+                self.manifest.save()
+                del received[(i,j)]
+        progress.close()
+    
     def update_data(self): 
         self.__check_seasons()
         self.__check_leagues()
         self.__create_tree()
+        self.manifest = MatchManifest(os.path.join(self.save_dir_path,self.dir_name,self.manifest_file))
+        self.__import_files()
         match_ids = self.__ids()
-        for i in tqdm_nb(range(len(self.leagues)),desc='League'):
-            d = pd.DataFrame()
-            for j in tqdm_nb(range(len(self.seasons)),desc='Seasons',leave=False):
-                d = pd.DataFrame()
-                for k in tqdm_nb(range(len(match_ids[i][j])),desc='Matches',leave=False):
-                    index = match_ids[i][j].index(match_ids[i][j][k]) + 1
-                    condition = self.__check_file(self.leagues[i],self.seasons[j],index)
-                    if condition == False:
-                        data = self.__scrape_data(str(match_ids[i][j][k]),1) ## scrape data from understat.com
-                        #data = self.__extract_data_api(match_ids[i][j][k])    ## extract data using understatapi
-                        time.sleep(0.1)
-                        if 'h' in data:
-                            df1 = pd.json_normalize(data, record_path=['h'])
-                        if 'a' in data:
-                            df2 = pd.json_normalize(data, record_path=['a'])
-                        df = pd.concat([df1,df2])
-                        df_full = pd.concat([d,df])
-                        d = df_full
-                        self.__create_json_file(df,self.leagues[i],self.seasons[j],index)
-                if self.save_csv_file:
-                    self.__save_csv_file(df_full,self.leagues[i],self.seasons[j])
+        jobs, expected = [], {}
+        for i in range(len(self.leagues)):
+            for j in range(len(self.seasons)):
+                for k in range(len(match_ids[i][j])):
+                    if self.replay or self.__check_file(match_ids[i][j][k]) == False:
+                        jobs.append((i,j,k,str(match_ids[i][j][k])))
+                        expected[(i,j)] = expected.get((i,j),0) + 1
+        
+        ## fetch -> parse -> write, connected by bounded queues
+        raw_queue = queue.Queue(maxsize=self.queue_size)
+        parsed_queue = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        fetcher = threading.Thread(target=self.__fetch_stage,args=(jobs,raw_queue,errors),daemon=True)
+        parser = threading.Thread(target=self.__parse_stage,args=(raw_queue,parsed_queue,errors),daemon=True)
+        fetcher.start()
+        parser.start()
+        self.__write_stage(parsed_queue,match_ids,expected,len(jobs))
+        parser.join()
+        self.manifest.save()
+        if len(errors) > 0:
+            raise errors[0]
+        
+        ## Seasons without new matches still get their csv file if it is missing
+        for i in range(len(self.leagues)):
+            for j in range(len(self.seasons)):
+                if (i,j) not in expected:
+                    self.__finish_season(i,j,match_ids[i][j],{},False)
 
 ## Class to Find IDs of matches
                     
 class FindIDs:
-    def __init__(self,parallel,save_dir_path=os.getcwd()):
+    def __init__(self,parallel,save_dir_path=os.getcwd(),incremental=False,max_misses=200,fetcher=None,cache=True,replay=False):
         self.save_dir_path = save_dir_path
         self.parallel = parallel
+        page_cache = PageCache(self.save_dir_path) if cache or replay else None
+        if replay:   ## Finds the IDs from the page cache, without any request
+            fetcher = PageFetcher(cache=page_cache,replay=True)
+        elif fetcher is None:
+            fetcher = PageFetcher(concurrency=16,cache=page_cache) if self.parallel == True else PageFetcher(concurrency=1,rate=10,cache=page_cache)
+        self.fetcher = fetcher
+        self.incremental = incremental
+        self.max_misses = max_misses   ## Consecutive empty IDs that end an incremental scan
+        self.ids_file = "league_ids.dat"
+        self.state_file = "league_ids_state.json"
         self.findids()
         
     def __boundaries(self):
@@ -192,19 +1304,9 @@ class FindIDs:
             max_year = today.year - 1
         return min_year, max_year
     
-    def __scrape_data(self,match_id,index):
-        base_url = "https://understat.com/match/"
+    def __parse_data(self,content,index=1):
         try:
-            url = base_url + match_id
-            res = requests.get(url)
-            soup = BeautifulSoup(res.content,"lxml")
-            scripts = soup.find_all("script")
-            strings = scripts[index].string
-            ind_start = strings.index("('")+2
-            ind_end = strings.index("')")
-            json_data = strings[ind_start:ind_end]
-            json_data = json_data.encode('utf8').decode('unicode_escape')
-            data = json.loads(json_data)
+            data = parse_match_page(content,index)
             if data['h'] == []:
                 first_record = data['a'][0]
             else:
@@ -244,11 +1346,14 @@ class FindIDs:
             ids.append(f)
         return ids, l, y
             
-    def __create_file(self,ids,leagues,years):
-        if not os.path.exists(self.save_dir_path):
+    def __create_dir(self):
+        ## An empty 'save_dir_path' is the current working directory, which exists
+        if self.save_dir_path != "":
             os.makedirs(self.save_dir_path, exist_ok=True)
-        
-        filename = os.path.join(self.save_dir_path,"league_ids.dat")
+    
+    def __create_file(self,ids,leagues,years):
+        self.__create_dir()
+        filename = os.path.join(self.save_dir_path,self.ids_file)
         with open(filename,'w') as wf:
             for i in range(len(leagues)):
                 for j in range(len(years)):
@@ -257,23 +1362,132 @@ class FindIDs:
                         strids = strids + " " + str(ids[i][j][k])
                     wf.write("{}: {}-{}: {}\n".format(leagues[i],years[j],str(int(years[j])+1),strids))
     
+    def __read_ids_file(self):
+        ## Reads 'league_ids.dat' into {(league, season): [ids]} keeping the order of the lines
+        entries = {}
+        filename = os.path.join(self.save_dir_path,self.ids_file)
+        if not os.path.isfile(filename):
+            return entries
+        with open(filename,'r') as rf:
+            for line in rf:
+                if line.strip() == "":
+                    continue
+                name, season, ids_str = line.split(":")
+                ids = []
+                for item in ids_str.split():
+                    if '-' in item:
+                        start, end = map(int, item.split('-'))
+                        ids += list(range(start, end+1))
+                    else:
+                        ids.append(int(item))
+                entries[(name.strip(),season.strip())] = ids
+        return entries
+    
+    def __merge_file(self,ids,leagues,years):
+        ## Adds the new IDs to the existing 'league_ids.dat' instead of rewriting it from a full scan
+        entries = self.__read_ids_file()
+        for i in range(len(leagues)):
+            for j in range(len(years)):
+                if len(ids[i][j]) == 0:
+                    continue
+                key = (leagues[i],"{}-{}".format(years[j],str(int(years[j])+1)))
+                known = entries.get(key,[])
+                seen = set(known)
+                new = [int(k) for k in ids[i][j] if int(k) not in seen]
+                entries[key] = sorted(known + new)
+        
+        self.__create_dir()
+        filename = os.path.join(self.save_dir_path,self.ids_file)
+        with open(filename + ".tmp",'w') as wf:
+            for (league, season), l in entries.items():
+                strids = ""
+                for k in range(len(l)):
+                    strids = strids + " " + str(l[k])
+                wf.write("{}: {}: {}\n".format(league,season,strids))
+        os.replace(filename + ".tmp",filename)
+    
+    def __load_state(self):
+        filename = os.path.join(self.save_dir_path,self.state_file)
+        if not os.path.isfile(filename):
+            return None
+        with open(filename,'r') as rf:
+            return json.load(rf)
+    
+    def __save_state(self,state):
+        self.__create_dir()
+        filename = os.path.join(self.save_dir_path,self.state_file)
+        with open(filename + ".tmp",'w') as wf:
+            json.dump(state,wf)
+        os.replace(filename + ".tmp",filename)
+    
+    def __update_state(self,state,matches,missed,max_year):
+        ## Stores the resolved matches, the high-water mark and the still empty IDs of the running season
+        for m, l, y, h, a in zip(matches['match_id'],matches['league'],matches['season'],matches['h_team'],matches['a_team']):
+            state['matches'][str(m)] = {'league': l, 'season': str(y), 'h_team': h, 'a_team': a}
+        resolved = [int(k) for k in state['matches'].keys()]
+        if len(resolved) > 0:
+            state['high_water_mark'] = max(resolved)
+        current = [int(k) for k, v in state['matches'].items() if v['season'] == str(max_year)]
+        floor = min(current) if len(current) > 0 else state['high_water_mark']
+        pending = set(state['pending']) | set(missed)
+        state['pending'] = sorted(k for k in pending if floor < k < state['high_water_mark'] and str(k) not in state['matches'])
+        return state
+    
+    def __fetch(self,index,desc="IDs"):
+        ## Scrapes the given IDs and returns the results in the same order
+        return self.fetcher.fetch_all(index,parse=self.__parse_data,desc=desc)
+    
+    def __scan_new(self,start):
+        ## Scans IDs after the high-water mark until 'max_misses' consecutive IDs contain no match
+        dfs, missed = [], []
+        misses = 0
+        while misses < self.max_misses:
+            index = [str(i) for i in range(start,start+self.max_misses)]
+            results = self.__fetch(index,desc="New IDs")
+            for i in range(len(results)):
+                if results[i] is None:
+                    misses += 1
+                    missed.append(int(index[i]))
+                else:
+                    misses = 0
+                    dfs.append(results[i])
+            start = start + self.max_misses
+        return dfs, missed
+    
+    def __find_incremental(self,state):
+        pending = [str(i) for i in state['pending']]
+        results = self.__fetch(pending,desc="Pending IDs")
+        dfs = [df for df in results if df is not None]
+        missed = [int(pending[i]) for i in range(len(results)) if results[i] is None]
+        
+        new_dfs, new_missed = self.__scan_new(state['high_water_mark']+1)
+        dfs += new_dfs
+        missed += new_missed
+        
+        min_year, max_year = self.__determine_years()
+        if len(dfs) == 0:
+            state = self.__update_state(state,pd.DataFrame(columns=['match_id','season','h_team','a_team','league']),missed,max_year)
+            self.__save_state(state)
+            print("No new matches found")
+            return
+        
+        df2 = pd.concat(dfs,ignore_index=True)
+        teams_leagues = self.__read_file()
+        matches = df2[['match_id','season','h_team','a_team']].copy()
+        ids, leagues, years = self.__modify_dataframe(matches,teams_leagues,min_year,max_year)
+        self.__merge_file(ids,leagues,years)
+        state = self.__update_state(state,matches,missed,max_year)
+        self.__save_state(state)
+    
     def findids(self):
-        index = self.__boundaries()
-        dfs = []
+        if self.incremental == True:
+            state = self.__load_state()
+            if state is not None:
+                self.__find_incremental(state)
+                return
         
-        if self.parallel == True:
-            num_cpus = multiprocessing.cpu_count()
-            
-            with concurrent.futures.ThreadPoolExecutor(max_workers=num_cpus) as executor:
-                results = [executor.submit(self.__scrape_data, index[i], 1) for i in range(len(index))]
-                for future in tqdm_nb(concurrent.futures.as_completed(results),total=len(index)):
-                    try:
-                        dfs.append(future.result())
-                    except:
-                        exit("Error in multithreading")
-        else:
-            for i in tqdm_nb(range(len(index)),desc="IDs"):
-                dfs.append(self.__scrape_data(index[i],1))
+        index = self.__boundaries()
+        dfs = self.__fetch(index)
         
         number_none = 0
         for i in range(len(dfs)):
@@ -286,10 +1500,15 @@ class FindIDs:
         df2 = pd.concat(dfs,ignore_index=True)
         
         teams_leagues = self.__read_file()
-        matches = df2[['match_id','season','h_team','a_team']]
+        matches = df2[['match_id','season','h_team','a_team']].copy()
         min_year, max_year = self.__determine_years()
         ids, leagues, years = self.__modify_dataframe(matches,teams_leagues,min_year,max_year)
         self.__create_file(ids,leagues,years)
+        
+        missed = [int(index[i]) for i in range(len(dfs)) if dfs[i] is None]
+        state = {'high_water_mark': 0, 'pending': [], 'matches': {}}
+        state = self.__update_state(state,matches,missed,max_year)
+        self.__save_state(state)
 
 ## Class to load data from a specific match
 
@@ -300,6 +1519,8 @@ class MatchDataLoader:
         self.season = season
         self.save_dir_path = save_dir_path
         self.dir_name = "Football_Data"
+        self.columns = ['season','h_team','a_team','h_goals','a_goals','situation','match_id','result','player','X','Y','xG','h_a',
+                        'team','in_box','Xmod','Ymod']
         #self.load_match_data()
     
     def __check_season(self):
@@ -314,14 +1535,19 @@ class MatchDataLoader:
             if int(f[1]) - int(f[0]) != 1:
                 exit("'seasons' cannot differ more than one. Modify")
     
-    def __find_match_id(self,match_path):
-        files = [f for f in os.listdir(match_path) if f.endswith('.json')]
-        for i in range(len(files)):
-            fullpath = os.path.join(match_path,files[i])
-            df = pd.read_json(fullpath)
-            if (df['h_team'] == self.home_team).any() and (df['a_team'] == self.away_team).any():
+    def __find_match_id(self):
+        store = ShotStore(self.save_dir_path)
+        entry = store.index().find(self.league,self.season,self.home_team,self.away_team)
+        if entry is not None:
+            df = store.read_match(entry,columns=self.columns)
+            if not df.empty:
                 return df
-        return pd.DataFrame()
+        ## Not indexed yet (e.g. data of an older version): scan the season and index it
+        filters = [('h_team','==',self.home_team),('a_team','==',self.away_team)]
+        df = store.read(self.league,self.season,columns=self.columns,filters=filters)
+        if not df.empty:
+            store.update_index(self.league,self.season,store.read(self.league,self.season,columns=['match_id','h_team','a_team']))
+        return df
     
     def __team_existance(self,l):
         h, a = False, False
@@ -353,67 +1579,124 @@ class MatchDataLoader:
         else:
             exit("The teams do not play in the same league")
         
-        match_path = os.path.join(self.save_dir_path,self.dir_name,self.league,self.season)
         self.__check_season()
-        df = self.__find_match_id(match_path)
+        df = self.__find_match_id()
         if df.empty:
             return None
         return df
 
+## Class to draw the pitch of MatchAnalyzer only once per process: new figures get the rendered pitch as background image
+
+class PitchTemplate:
+    pitch_x = 95.65
+    pitch_y = 70.00
+    cache = {}   ## "pitch" -> mplsoccer Pitch, dpi -> (image, axes position, x limits, y limits, figure size)
+    raster_formats = ['png','jpg','jpeg','tif','tiff','webp','raw','rgba']   ## Formats saved as a bitmap
+    
+    @classmethod
+    def pitch(cls):
+        if "pitch" not in cls.cache:
+            cls.cache["pitch"] = mplsoccer_pitch.Pitch(pitch_type="custom", pitch_color='grass', line_color='white', stripe=True, pitch_length=cls.pitch_x, pitch_width=cls.pitch_y)
+        return cls.cache["pitch"]
+    
+    @classmethod
+    def __render(cls,dpi):
+        ## Draws the pitch on an off-screen Agg canvas, as Pitch.draw() would on a new figure
+        figsize = plt.rcParams['figure.figsize']
+        fig = mpl_figure.Figure(figsize=figsize,dpi=dpi)
+        backend_agg.FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        cls.pitch().draw(ax=ax)
+        fig.tight_layout()
+        fig.canvas.draw()
+        return (np.array(fig.canvas.buffer_rgba()), ax.get_position(), ax.get_xlim(), ax.get_ylim(), figsize)
+    
+    @classmethod
+    def draw(cls,dpi=None,vector=False):
+        ## Returns fig, ax like Pitch.draw(): 'ax' has the coordinates of the pitch and lies over the image pre-rendered
+        ## at 'dpi' (the resolution the figure will be saved at). vector=True, or no 'dpi', draws the pitch lines instead:
+        ## for figures saved as svg, pdf... and for figures shown on screen, where a resized window would move the
+        ## shots off the image
+        if vector or dpi is None:
+            return cls.pitch().draw()
+        if dpi not in cls.cache:
+            cls.cache[dpi] = cls.__render(dpi)
+        image, position, xlim, ylim, figsize = cls.cache[dpi]
+        fig = plt.figure(figsize=figsize,dpi=dpi)
+        background = fig.add_axes([0,0,1,1])
+        background.imshow(image,interpolation='none',aspect='auto')
+        background.axis('off')
+        ax = fig.add_axes(position)
+        ax.set_xlim(xlim)
+        ax.set_ylim(ylim)
+        ax.set_aspect(1)
+        ax.axis('off')
+        return fig, ax
+
 ## Class to analyze the data of a specific match
 
 class MatchAnalyzer:
-    def __init__(self,data):
-        self.data = data
+    def __init__(self,data,plot=True,dpi=None,vector=False):
+        self.data = as_pandas(data)
+        self.plot = plot   ## False skips the shot map: analyze_match then only computes the table
         if self.data is not None:
-            self.pitch_x = 95.65
-            self.pitch_y = 70.00
-            self.pitch = Pitch(pitch_type="custom", pitch_color='grass', line_color='white', stripe=True, pitch_length=self.pitch_x, pitch_width=self.pitch_y)
-            self.fig, self.ax = self.pitch.draw()
+            self.pitch_x = PitchTemplate.pitch_x
+            self.pitch_y = PitchTemplate.pitch_y
+            if self.plot:   ## 'dpi' and 'vector': see PitchTemplate.draw
+                self.pitch = PitchTemplate.pitch()
+                self.fig, self.ax = PitchTemplate.draw(dpi,vector)
         #self.analyze_match()
     
     def __modify_dataframe(self,df):
-        df['important_team'] = np.where(df['h_a'] == 'h', df['h_team'], df['a_team'])
-        df = df[['season','h_team','a_team','h_goals','a_goals','situation','match_id','result','player','X','Y','xG','important_team']]
+        if 'in_box' not in df.columns:   ## Not read from the store
+            df = ShotStore.derive(df)
+        df = df.assign(important_team=df['team'].astype(str))
+        df = df[['season','h_team','a_team','h_goals','a_goals','situation','match_id','result','player','X','Y','xG','important_team',
+                 'in_box','Xmod','Ymod']]
         return df
         
     def __draw_shots(self,df,team,color,specifier):
         team_events = df.loc[df['important_team']==team]
         if team_events.empty:
             if specifier == 'home':
-                self.ax.text(2,5,df['h_team'].astype(str).tolist()[0] + " : " + df['h_goals'].astype(str).tolist()[0],c=color,fontsize=14)
-                self.ax.text(2,10,"xG: 0.000",c=color,fontsize=14)
+                if self.plot:
+                    self.ax.text(2,5,df['h_team'].astype(str).tolist()[0] + " : " + df['h_goals'].astype(str).tolist()[0],c=color,fontsize=14)
+                    self.ax.text(2,10,"xG: 0.000",c=color,fontsize=14)
                 t = df['h_team'].astype(str).tolist()[0]
             if specifier == 'away':
-                self.ax.text(62,5,df['a_team'].astype(str).tolist()[0] +" : " + df['a_goals'].astype(str).tolist()[0],c=color,fontsize=14)
-                self.ax.text(62,10,"xG: 0.000",c=color,fontsize=14)
+                if self.plot:
+                    self.ax.text(62,5,df['a_team'].astype(str).tolist()[0] +" : " + df['a_goals'].astype(str).tolist()[0],c=color,fontsize=14)
+                    self.ax.text(62,10,"xG: 0.000",c=color,fontsize=14)
                 t = df['a_team'].astype(str).tolist()[0]
             return 0, 0, 0, 0, 0, t
         
         goal = team_events.loc[team_events['result']=='Goal']
         nogoal = team_events.loc[team_events['result']!='Goal']
-        xGgoal = goal['xG'].astype(float) * self.pitch_x
-        xGnogoal = nogoal['xG'].astype(float) * self.pitch_x
+        xGgoal = goal['xG'] * self.pitch_x
+        xGnogoal = nogoal['xG'] * self.pitch_x
 
-        total_xG = round(team_events['xG'].sum(),3)
-        mean_xG = round(team_events['xG'].mean(),3)
+        xG = team_events['xG'].astype(float)   ## A float32 sum keeps its noise digits once rounded
+        total_xG = round(xG.sum(),3)
+        mean_xG = round(xG.mean(),3)
         chances = len(team_events)
         big_chances = len(team_events[team_events['xG'] > 0.3]['xG'])
         
         if team.tolist()[0] == team_events['h_team'].tolist()[0]:
-            self.ax.scatter(goal['X'].astype(float)*self.pitch_x,goal['Y'].astype(float)*self.pitch_y,c=color,s=xGgoal,marker=(5,2))
-            self.ax.scatter(nogoal['X'].astype(float)*self.pitch_x,nogoal['Y'].astype(float)*self.pitch_y,s=xGnogoal,facecolors='none',edgecolors=color,marker='o')
-            self.ax.text(2,self.pitch_y-5,team_events['important_team'].astype(str).tolist()[0] + " : " + team_events['h_goals'].astype(str).tolist()[0],c=color,fontsize=14)
-            self.ax.text(2,self.pitch_y-10,"xG: " + str(total_xG),c=color,fontsize=14)
+            if self.plot:
+                self.ax.scatter(goal['Xmod'],goal['Ymod'],c=color,s=xGgoal,marker=(5,2))
+                self.ax.scatter(nogoal['Xmod'],nogoal['Ymod'],s=xGnogoal,facecolors='none',edgecolors=color,marker='o')
+                self.ax.text(2,self.pitch_y-5,team_events['important_team'].astype(str).tolist()[0] + " : " + team_events['h_goals'].astype(str).tolist()[0],c=color,fontsize=14)
+                self.ax.text(2,self.pitch_y-10,"xG: " + str(total_xG),c=color,fontsize=14)
             t = team.tolist()[0]
-            penalty_area = len(team_events[(team_events['X'].astype(float)*self.pitch_x >= self.pitch_x-16.5) & (team_events['Y'].astype(float)*self.pitch_y >= 15.0) & (team_events['Y'].astype(float)*self.pitch_y <= 55.00)])
+            penalty_area = int(team_events['in_box'].sum())
         elif team.tolist()[0] == team_events['a_team'].tolist()[0]:
-            self.ax.scatter((1-goal['X'].astype(float))*self.pitch_x,(1-goal['Y'].astype(float))*self.pitch_y,c=color,s=xGgoal,marker=(5,2))
-            self.ax.scatter((1-nogoal['X'].astype(float))*self.pitch_x,(1-nogoal['Y'].astype(float))*self.pitch_y,s=xGnogoal,facecolors='none', edgecolors=color,marker='o')
-            self.ax.text(self.pitch_x/2+2,self.pitch_y-5,team_events['important_team'].astype(str).tolist()[0] +" : " + team_events['a_goals'].astype(str).tolist()[0],c=color,fontsize=14)
-            self.ax.text(self.pitch_x/2+2,self.pitch_y-10,"xG: " + str(total_xG),c=color,fontsize=14)
+            if self.plot:
+                self.ax.scatter(goal['Xmod'],goal['Ymod'],c=color,s=xGgoal,marker=(5,2))
+                self.ax.scatter(nogoal['Xmod'],nogoal['Ymod'],s=xGnogoal,facecolors='none', edgecolors=color,marker='o')
+                self.ax.text(self.pitch_x/2+2,self.pitch_y-5,team_events['important_team'].astype(str).tolist()[0] +" : " + team_events['a_goals'].astype(str).tolist()[0],c=color,fontsize=14)
+                self.ax.text(self.pitch_x/2+2,self.pitch_y-10,"xG: " + str(total_xG),c=color,fontsize=14)
             t = team.tolist()[0]
-            penalty_area = len(team_events[((1-team_events['X'].astype(float))*self.pitch_x <= 16.5) & ((1-team_events['Y'].astype(float))*self.pitch_y >= 15.0) & ((1-team_events['Y'].astype(float))*self.pitch_y <= 55.00)])
+            penalty_area = int(team_events['in_box'].sum())
         return total_xG, mean_xG, chances, big_chances, penalty_area, t
     
     def __data_table(self,total_xG_h,mean_xG_h,chances_h,big_chances_h,penalty_area_h,h_team,total_xG_a,mean_xG_a,chances_a,big_chances_a,penalty_area_a,a_team):
@@ -433,16 +1716,151 @@ class MatchAnalyzer:
         total_xG_a, mean_xG_a, chances_a, big_chances_a, penalty_area_a, a_team = self.__draw_shots(df,df['a_team'],'red','away')
         table = self.__data_table(total_xG_h, mean_xG_h, chances_h, big_chances_h, penalty_area_h, h_team,total_xG_a, mean_xG_a, chances_a, big_chances_a, penalty_area_a, a_team)
         return table
+    
+    @staticmethod
+    def analyze_matches(data):
+        ## The values of analyze_match for every match in 'data' (e.g. the shots of a whole season) in one grouped pass.
+        ## One row per match and team; a team without shots gets zeros
+        data = as_pandas(data)
+        if 'in_box' not in data.columns:   ## Not read from the store
+            data = ShotStore.derive(data)
+        home = (data['h_a'].astype(str) == 'h').to_numpy()
+        xG = data['xG'].to_numpy(dtype=float)   ## Sums in float64
+        in_box = data['in_box'].to_numpy()
+        shots = pd.DataFrame({'match_id': data['match_id'].to_numpy(), 'venue': np.where(home,'h','a'),
+                              'xG': xG, 'big': xG > 0.3, 'box': in_box})
+        values = shots.groupby(['match_id','venue']).agg(total_xG=('xG','sum'), xG_per_chance=('xG','mean'), chances=('xG','size'),
+                                                         big_chances=('big','sum'), box_chances=('box','sum')).reset_index()
+        
+        keys = [c for c in ['season','match_id','h_team','a_team','h_goals','a_goals'] if c in data.columns]
+        matches = data[keys].drop_duplicates('match_id')
+        frames = []
+        for venue, team, goals in (('h','h_team','h_goals'),('a','a_team','a_goals')):
+            rows = matches[[c for c in ['season','match_id'] if c in keys]].copy()
+            rows['team'] = matches[team].astype(str)
+            rows['venue'] = venue
+            if goals in keys:
+                rows['goals'] = matches[goals].astype(int)
+            frames.append(rows)
+        table = pd.concat(frames,ignore_index=True).merge(values,on=['match_id','venue'],how='left')
+        table[['total_xG','xG_per_chance']] = np.round(table[['total_xG','xG_per_chance']].fillna(0.0).to_numpy(),3)
+        table[['chances','big_chances','box_chances']] = table[['chances','big_chances','box_chances']].fillna(0).astype(int)
+        return table.sort_values(['match_id','venue'],ascending=[True,False],ignore_index=True)
+    
+    @staticmethod
+    def draw_matches(data,match_ids=None):
+        ## Shot maps of the requested matches of 'data' (all of them by default): match_id -> figure
+        figures = {}
+        data = as_pandas(data)
+        for match_id, df in data.groupby('match_id',sort=False,observed=True):
+            if match_ids is None or match_id in match_ids:
+                match = MatchAnalyzer(df.reset_index(drop=True))
+                match.analyze_match()
+                figures[match_id] = match.fig
+        return figures
+
+## Class to compute the season aggregates of a league with grouped operations on the shots
+
+class LeagueAggregator:
+    def __init__(self,data=None,matches=None):
+        ## 'matches' (the team_matches table of AggregateStore) replaces the shots in the team figures;
+        ## the shots are then only needed for player_table, and a ShotTable (e.g. memory-mapped) is kept as it is
+        self.matches = matches
+        self.shots = None
+        if isinstance(data,ShotTable) and self.matches is not None and 'F/A' not in data.columns:
+            self.shots = data
+        elif data is not None:
+            data = as_pandas(data)
+            if 'F/A' in data.columns:
+                data = data[data['F/A'] == 'For']
+            columns = ['h_team','a_team','h_a','situation','result','player'] if self.matches is None else ['result','player']
+            self.shots = pd.DataFrame(dict((c, data[c].astype(str)) for c in columns))
+            self.shots['xG'] = as_float64(data['xG'])
+        if self.matches is not None:
+            self.matches = pd.DataFrame({'team': matches['team'].astype(str), 'opponent': matches['opponent'].astype(str),
+                                         'venue': matches['venue'].astype(str), 'xG_for': matches['xG_for'].astype(float),
+                                         'xG_ag': matches['xG_ag'].astype(float), 'op_xG_for': matches['op_xG_for'].astype(float),
+                                         'op_xG_ag': matches['op_xG_ag'].astype(float)})
+            self.teams = sorted(set(self.matches['team']))
+        else:
+            home = self.shots['h_a'] == 'h'
+            self.shots['team'] = self.shots['h_team'].where(home, self.shots['a_team'])
+            self.shots['opponent'] = self.shots['a_team'].where(home, self.shots['h_team'])
+            self.teams = sorted(set(self.shots['h_team']) | set(self.shots['a_team']))
+    
+    def __round(self,values):
+        return np.round(np.asarray(values,dtype=float),3)
+    
+    def fixtures(self):
+        ## One row per team and fixture: open-play xG for and against, rounded to three decimals
+        if self.matches is not None:
+            at_home = self.matches[self.matches['venue'] == 'h'].set_index(['team','opponent'])
+            home = at_home['op_xG_for'].unstack(fill_value=0.0).reindex(index=self.teams,columns=self.teams,fill_value=0.0).to_numpy()
+            away = at_home['op_xG_ag'].unstack(fill_value=0.0).reindex(index=self.teams,columns=self.teams,fill_value=0.0).to_numpy()
+        else:
+            open_play = self.shots[self.shots['situation'] == 'OpenPlay']
+            by_side = open_play.groupby(['h_team','a_team','h_a'])['xG'].sum().unstack(fill_value=0.0)
+            home = by_side.get('h',pd.Series(0.0,index=by_side.index)).unstack(fill_value=0.0).reindex(index=self.teams,columns=self.teams,fill_value=0.0).to_numpy()
+            away = by_side.get('a',pd.Series(0.0,index=by_side.index)).unstack(fill_value=0.0).reindex(index=self.teams,columns=self.teams,fill_value=0.0).to_numpy()
+        
+        n = len(self.teams)
+        i, j = np.nonzero(~np.eye(n,dtype=bool))   ## every (team, opponent) pair
+        teams = np.array(self.teams,dtype=object)
+        at_home = pd.DataFrame({'team': teams[i], 'opponent': teams[j], 'venue': 'h',
+                                'xG_for': self.__round(home[i,j]), 'xG_ag': self.__round(away[i,j])})
+        away_from_home = pd.DataFrame({'team': teams[i], 'opponent': teams[j], 'venue': 'a',
+                                       'xG_for': self.__round(away[j,i]), 'xG_ag': self.__round(home[j,i])})
+        return pd.concat([at_home,away_from_home],ignore_index=True)
+    
+    def team_table(self):
+        ## One row per team: matches, average xG for/against per match and median open-play xG per fixture
+        if self.matches is not None:
+            matches = self.matches.groupby('team').size().reindex(self.teams,fill_value=0)
+            xG_for = self.matches.groupby('team')['xG_for'].sum().reindex(self.teams,fill_value=0.0)
+            xG_ag = self.matches.groupby('team')['xG_ag'].sum().reindex(self.teams,fill_value=0.0)
+        else:
+            matches = (self.shots.groupby('h_team')['a_team'].nunique().reindex(self.teams,fill_value=0) +
+                       self.shots.groupby('a_team')['h_team'].nunique().reindex(self.teams,fill_value=0))
+            xG_for = self.shots.groupby('team')['xG'].sum().reindex(self.teams,fill_value=0.0)
+            xG_ag = self.shots.groupby('opponent')['xG'].sum().reindex(self.teams,fill_value=0.0)
+        medians = self.fixtures().groupby('team')[['xG_for','xG_ag']].agg(statistics.median).reindex(self.teams)
+        
+        table = pd.DataFrame({'matches': matches}, index=pd.Index(self.teams,name='team'))
+        table['avg_xG_for'] = self.__round(xG_for / matches)
+        table['avg_xG_ag'] = self.__round(xG_ag / matches)
+        table['avg_xG_diff'] = table['avg_xG_for'] - table['avg_xG_ag']
+        table['med_xG_for'] = medians['xG_for']
+        table['med_xG_ag'] = medians['xG_ag']
+        table['med_xG_diff'] = self.__round(table['med_xG_for'] - table['med_xG_ag'])
+        return table
+    
+    def player_table(self):
+        ## One row per player: total xG, goals and the xG of the scored and missed chances
+        if isinstance(self.shots,ShotTable):
+            goal = self.shots.mask('result','Goal')
+            xG = as_float64(self.shots.columns['xG'])
+            table = self.shots.group_sum(['player'],{'total_xG': xG, 'goals': goal.astype(int),
+                                                     'xG_scored': np.where(goal,xG,0.0), 'xG_missed': np.where(goal,0.0,xG)})
+            table['player'] = table['player'].astype(str)
+            return table.drop(columns='count')
+        goal = self.shots['result'] == 'Goal'
+        values = pd.DataFrame({'player': self.shots['player'], 'total_xG': self.shots['xG'], 'goals': goal.astype(int),
+                               'xG_scored': self.shots['xG'].where(goal,0.0), 'xG_missed': self.shots['xG'].where(~goal,0.0)})
+        return values.groupby('player',as_index=False)[['total_xG','goals','xG_scored','xG_missed']].sum()
 
 ## Class to analyze all the matches of a league
 
 class LeagueAnalyzer:
-    def __init__(self,league,seasons,save_dir_path=os.getcwd(),save_players_csv=False):
+    def __init__(self,league,seasons,save_dir_path=os.getcwd(),save_players_csv=False,mapped=False,plot=True):
         self.league = league
         self.seasons = seasons
         self.save_dir_path = save_dir_path
         self.dir_name = "Football_Data"
         self.save_players_csv = save_players_csv
+        self.mapped = mapped   ## Reads the memory-mapped columns of ShotStore.map_season (shared by worker processes)
+        self.plot = plot       ## False: only the tables, no figure
+        self.columns = ['result','player','xG']   ## The team figures come from the aggregates, the shots are for the players
+        self.results = {}      ## season -> result of analyze_season
         self.analyze_league()
     
     def __check_league(self):
@@ -463,74 +1881,28 @@ class LeagueAnalyzer:
                 if int(f[1]) - int(f[0]) != 1:
                     exit("'seasons' cannot differ more than one. Modify")
     
-    def __load_data(self,match_path):
-        files = [f for f in os.listdir(match_path) if f.endswith('.json')]
-        df = pd.DataFrame()
-        for i in range(len(files)):
-            fullpath = os.path.join(match_path,files[i])
-            df_new = pd.read_json(fullpath)
-            data = pd.concat([df,df_new],ignore_index=True)
-            df = data
-        return data
+    def __load_data(self,season):
+        store = ShotStore(self.save_dir_path)
+        if self.mapped:
+            return store.map_season(self.league,season).select(self.columns)
+        return store.read(self.league,season,columns=self.columns)
     
-    def __modify_dataframe(self,df):
-        df['important_team'] = np.where(df['h_a'] == 'h', df['h_team'], df['a_team']) ## Add the name of the team performed the action
-        return df
+    def __load_matches(self,season):
+        return AggregateStore(self.save_dir_path).read("team_matches",self.league,[season])
     
     def __find_teams(self,df):
-        home_teams = df['h_team'].tolist()
-        away_teams = df['a_team'].tolist()
-        teams = home_teams + away_teams 
+        teams = df['team'].astype(str).tolist()
         teams = list(set(teams))
         return teams
     
-    def __find_matches(self,df,teams):
-        number = []
-        for i in range(len(teams)):
-            df_home_matches = df[df['h_team']==teams[i]]['a_team']
-            home_matches = df_home_matches.tolist()
-            df_away_matches = df[df['a_team']==teams[i]]['h_team']
-            away_matches = df_away_matches.tolist()
-            matches = len(list(set(home_matches))+ list(set(away_matches)))
-            number.append(matches)
-        return number
-    
-    def __add_data(self,df):
-        df['F/A'] = ['For'] * len(df)
-        part = df.copy()
-        part['important_team'] = part.apply(lambda x: x['h_team'] if x['important_team'] == x['a_team'] else x['a_team'], axis=1)
-        part['F/A'] = 'Against'
-        result = pd.concat([df, part], ignore_index=True)
-        return result
-    
     def __sort_list_rev(self,mylistA, mylistB):
         s_A = sorted(mylistA,reverse=True)
         s_B = [i for _, i in sorted(zip(mylistA,mylistB),reverse=True)]
         return s_A, s_B
         
-    def __plot_figs(self,s,teams,matches):
-        xG_for, xG_ag = [], []
-        team_xG_for_game, team_xG_ag_game = [], []
-        for i in range(len(teams)):
-            t1, t2 = [], []
-            for j in range(len(teams)):
-                if teams[i] != teams[j]:
-                    a1 = self.data[(self.data['important_team'] == teams[i]) & (self.data['a_team'] == teams[j]) & (self.data['F/A'] == 'For') & (self.data['situation'] == "OpenPlay")]
-                    a2 = self.data[(self.data['important_team'] == teams[i]) & (self.data['h_team'] == teams[j]) & (self.data['F/A'] == 'For') & (self.data['situation'] == "OpenPlay")]
-                    a3 = self.data[(self.data['important_team'] == teams[i]) & (self.data['a_team'] == teams[j]) & (self.data['F/A'] == 'Against') & (self.data['situation'] == "OpenPlay")]
-                    a4 = self.data[(self.data['important_team'] == teams[i]) & (self.data['h_team'] == teams[j]) & (self.data['F/A'] == 'Against') & (self.data['situation'] == "OpenPlay")]
-                    t1.append(round(a1['xG'].sum(),3))
-                    t1.append(round(a2['xG'].sum(),3))
-                    t2.append(round(a3['xG'].sum(),3))
-                    t2.append(round(a4['xG'].sum(),3))
-            team_xG_for_game.append(t1) 
-            team_xG_ag_game.append(t2)
-            t_f = self.data[(self.data['important_team'] == teams[i]) & (self.data['F/A'] == 'For')]
-            t_a = self.data[(self.data['important_team'] == teams[i]) & (self.data['F/A'] == 'Against')]
-            xg_for_t = t_f['xG'].sum()/matches[i]
-            xg_ag_t = t_a['xG'].sum()/matches[i]
-            xG_for.append(round(xg_for_t,3))     ## Average xG-for of each team
-            xG_ag.append(round(xg_ag_t,3))       ## Average xG-ag  of each team
+    def __plot_figs(self,s,teams,team_table):
+        xG_for = team_table['avg_xG_for'].tolist()     ## Average xG-for of each team
+        xG_ag = team_table['avg_xG_ag'].tolist()       ## Average xG-ag  of each team
         
         avg_xG_for = sum(xG_for)/len(xG_for) ## Average xG-for of league
         avg_xG_ag = sum(xG_ag)/len(xG_ag)    ## Average xG-ag  of league
@@ -545,42 +1917,8 @@ class LeagueAnalyzer:
         for i, txt in enumerate(teams):
             ax.annotate(txt,(xG_for[i],xG_ag[i]),fontsize=8)
         
-        avg_xG_diff = [xG_for[i]-xG_ag[i] for i in range(len(xG_for))]  ## Average xG difference of each team
-        
-        med_xG_for, med_xG_ag = [], []
-        for i in range(len(teams)):
-            med_xG_for.append(statistics.median(team_xG_for_game[i]))
-            med_xG_ag.append(statistics.median(team_xG_ag_game[i]))
-        
-        med_xG_diff = []
-        for i in range(len(med_xG_for)):
-            med_xG_diff.append(round(med_xG_for[i]-med_xG_ag[i],3))
-        
-        xG_diff = []
-        for i in range(len(team_xG_for_game)):
-            f = []
-            for j in range(len(team_xG_for_game[i])):
-                f.append(team_xG_for_game[i][j] - team_xG_ag_game[i][j])
-            xG_diff.append(f)
-        
-        players = list(set(self.data['player'].tolist()))
-        total_xg, goals_scored, xg_g, xg_ng = [], [], [], []
-        
-        for i in range(len(players)):
-            total_xg.append(self.data[(self.data['player']==players[i]) & (self.data['F/A']=='For')]['xG'].sum())
-            goals_scored.append(len(self.data[(self.data['player']==players[i]) & (self.data['result']=='Goal') & (self.data['F/A']=='For')]))
-            xg_g.append(self.data[(self.data['player']==players[i]) & (self.data['result']=='Goal') & (self.data['F/A']=='For')]['xG'].sum())
-            xg_ng.append(self.data[(self.data['player']==players[i]) & (self.data['result']!='Goal') & (self.data['F/A']=='For')]['xG'].sum())
-        
-        mydf = pd.DataFrame(list(zip(players,total_xg,goals_scored,xg_g,xg_ng)),columns=['player','total_xG','goals','xG_scored','xG_missed'])
-        players_data = mydf.sort_values(by=['xG_missed'],ascending=False)
-        print(f"------------ {self.league}: {s} ------------")
-        print(players_data[['player','total_xG','goals','xG_scored','xG_missed']].head(20).to_string(index=False))
-        print("\n")
-        
-        if self.save_players_csv:
-            file_name = "players_" + self.league + "_" + str(s) + ".csv"
-            players_data[['player','total_xG','goals','xG_scored','xG_missed']].to_csv(os.path.join(self.save_dir_path,self.dir_name,file_name),index=False,encoding='utf-8-sig')
+        avg_xG_diff = team_table['avg_xG_diff'].tolist()  ## Average xG difference of each team
+        med_xG_diff = team_table['med_xG_diff'].tolist()  ## Median xG difference of each team
         
         fig2, (ax1, ax2) = plt.subplots(2,1,figsize=(15,15))
         fig2.tight_layout(h_pad=12)
@@ -604,20 +1942,149 @@ class LeagueAnalyzer:
         ax2.set_title(self.league + ": " + s)
         ax2.set_xticklabels(s_teams_med_diff, rotation=90)
         ax2.set_ylabel("Median xG-diff per match")
+    
+    def analyze_season(self,s):
+        ## Team and player tables of one season (and its figures if self.plot), with the time spent in each step.
+        ## The data of the season is local: nothing is kept from one season to the next
+        start = time.perf_counter()
+        matches = self.__load_matches(s)
+        if len(matches) == 0:   ## Season not downloaded
+            error = "No data for " + self.league + " " + str(s)
+            print(error)
+            return {'league': self.league, 'season': s, 'error': error, 'seconds': {'total': time.perf_counter() - start}}
+        teams = self.__find_teams(matches)
+        data = self.__load_data(s)
+        loaded = time.perf_counter()
+        
+        aggregates = LeagueAggregator(data,matches)
+        team_table = aggregates.team_table().reindex(teams)
+        players_data = aggregates.player_table().sort_values(by=['xG_missed'],ascending=False)
+        players_data = players_data[['player','total_xG','goals','xG_scored','xG_missed']]
+        
+        print(f"------------ {self.league}: {s} ------------")
+        print(players_data.head(20).to_string(index=False))
+        print("\n")
+        
+        if self.save_players_csv:
+            file_name = "players_" + self.league + "_" + str(s) + ".csv"
+            players_data.to_csv(os.path.join(self.save_dir_path,self.dir_name,file_name),index=False,encoding='utf-8-sig')
+        aggregated = time.perf_counter()
+        
+        if self.plot:
+            self.__plot_figs(s,teams,team_table)
+        end = time.perf_counter()
+        return {'league': self.league, 'season': s, 'teams': team_table, 'players': players_data,
+                'seconds': {'load': loaded - start, 'aggregate': aggregated - loaded, 'plot': end - aggregated, 'total': end - start}}
         
     def analyze_league(self):
-        df = pd.DataFrame()
         self.__check_seasons()
         self.__check_league()
         for i in range(len(self.seasons)):
-            match_path = os.path.join(self.save_dir_path,self.dir_name,self.league,self.seasons[i])
-            df_new = self.__load_data(match_path)
-            teams = self.__find_teams(df_new)
-            matches = self.__find_matches(df_new,teams)
-            df_new = self.__modify_dataframe(df_new)
-            df_new = self.__add_data(df_new)
-            self.data = pd.concat([df,df_new],ignore_index=True)
-            self.__plot_figs(self.seasons[i],teams,matches) 
+            self.results[self.seasons[i]] = self.analyze_season(self.seasons[i])
+
+## Function to analyze one season of one league (runs in the worker processes of MultiLeagueAnalyzer). The
+## figures are drawn and saved only if 'out_dir' is given
+
+def analyze_league_season(league,season,save_dir_path,save_players_csv,out_dir,formats,dpi):
+    start = time.perf_counter()
+    if out_dir is not None:
+        plt.switch_backend('Agg')
+        plt.close('all')
+    try:
+        with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+            warnings.simplefilter('ignore')
+            analyzer = LeagueAnalyzer(league,[season],save_dir_path,save_players_csv,mapped=True,plot=out_dir is not None)
+    except (Exception, SystemExit) as error:   ## The analyzer stops with exit() on invalid input
+        if out_dir is not None:
+            plt.close('all')
+        return {'league': league, 'season': season, 'error': str(error), 'seconds': {'total': time.perf_counter() - start}}
+    result = analyzer.results[season]
+    if 'error' in result:
+        return result
+    result['files'] = []
+    if out_dir is not None:
+        saving = time.perf_counter()
+        for k, number in enumerate(plt.get_fignums()):
+            fig = plt.figure(number)
+            for fmt in formats:
+                result['files'].append(os.path.join(out_dir, league + "_" + season + "_" + str(k+1) + "." + fmt))
+                fig.savefig(result['files'][-1],dpi=dpi)
+            plt.close(fig)
+        result['seconds']['save'] = time.perf_counter() - saving
+    result['seconds']['total'] = time.perf_counter() - start
+    return result
+
+## Class to analyze many leagues and seasons at once: every (league, season) is one job of a process pool, the
+## per-season tables are merged into one summary of all leagues. The workers read the memory-mapped columns of
+## ShotStore.map_season, exported once before the jobs start
+
+class MultiLeagueAnalyzer:
+    def __init__(self,leagues,seasons,save_dir_path=os.getcwd(),save_players_csv=False,workers=None,out_dir=None,formats=('png',),dpi=100):
+        self.leagues = leagues
+        self.seasons = seasons
+        self.save_dir_path = save_dir_path
+        self.dir_name = "Football_Data"
+        self.save_players_csv = save_players_csv
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.out_dir = out_dir     ## The figures are saved there if given, otherwise none is drawn
+        self.formats = list(formats)
+        self.dpi = dpi
+        self.results = []          ## One result of analyze_league_season per (league, season)
+        self.summary = None        ## One row per league, season and team
+        self.players = None        ## One row per league, season and player
+        self.analyze_leagues()
+    
+    def __export(self,units):
+        store = ShotStore(self.save_dir_path)
+        for league, season in units:
+            try:
+                store.map_season(league,season)
+            except (OSError, ValueError):   ## Reported by the job itself
+                pass
+    
+    def __merge(self):
+        teams, players = [], []
+        for result in self.results:
+            if 'error' in result:
+                continue
+            for tables, table in ((teams,result['teams'].reset_index()), (players,result['players'])):
+                table.insert(0,'season',result['season'])
+                table.insert(0,'league',result['league'])
+                tables.append(table)
+        self.summary = pd.concat(teams,ignore_index=True) if len(teams) > 0 else pd.DataFrame()
+        self.players = pd.concat(players,ignore_index=True) if len(players) > 0 else pd.DataFrame()
+    
+    def analyze_leagues(self):
+        units = [(league, season) for league in self.leagues for season in self.seasons]
+        if self.out_dir is not None:
+            os.makedirs(self.out_dir, exist_ok=True)
+        self.__export(units)
+        start = time.perf_counter()
+        self.results = [None] * len(units)
+        progress = tqdm_notebook.tqdm(total=len(units),desc='Leagues',leave=False)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max(1,min(self.workers,len(units)))) as executor:
+            futures = dict((executor.submit(analyze_league_season,league,season,self.save_dir_path,self.save_players_csv,
+                                            self.out_dir,self.formats,self.dpi), i) for i, (league, season) in enumerate(units))
+            for future in concurrent.futures.as_completed(futures):
+                self.results[futures[future]] = future.result()
+                progress.update(1)
+        progress.close()
+        elapsed = time.perf_counter() - start
+        self.__merge()
+        
+        for result in self.results:
+            name = result['league'] + ": " + result['season']
+            if 'error' in result:
+                print(name + ": failed (" + result['error'] + ")")
+                continue
+            seconds = result['seconds']
+            print(name + ": {:.1f} ms (load {:.1f}, aggregate {:.1f}, figures {:.1f})".format(
+                seconds['total']*1000,seconds['load']*1000,seconds['aggregate']*1000,(seconds['plot'] + seconds.get('save',0.0))*1000))
+        print("{} seasons in {:.1f} s with {} processes\n".format(len(units),elapsed,max(1,min(self.workers,len(units)))))
+        if len(self.summary) > 0:
+            print("------------ Best average xG difference per match ------------")
+            print(self.summary.sort_values(by=['avg_xG_diff'],ascending=False)[['league','season','team','matches','avg_xG_for','avg_xG_ag','avg_xG_diff']].head(20).to_string(index=False))
+            print("\n")
 
 ## Class to load data from all matches of a team 
 
@@ -627,7 +2094,9 @@ class TeamDataLoader:
         self.team = team
         self.save_dir_path = save_dir_path
         self.dir_name = "Football_Data"
-        self.load_team_data()
+        self.columns = ['season','match_id','h_team','a_team','h_goals','a_goals','h_a','minute','situation','shotType','result','player','X','Y','xG',
+                        'team','opponent','distance','big_chance']
+        #self.load_team_data()
     
     def __check_seasons(self):
         for i in range(len(self.seasons)):
@@ -645,44 +2114,32 @@ class TeamDataLoader:
     def __find_team_league(self):
         obj = CheckFile() 
         data = obj.get_data()
+        if self.team not in data:
+            exit("Team '" + str(self.team) + "' is not found. Make sure it is spelled correctly")
         return data[self.team]
     
-    def __read_files(self,path):
-        files = [f for f in os.listdir(path) if f.endswith('.json')]
-        df = pd.DataFrame()
-        for i in range(len(files)):
-            fullpath = os.path.join(path,files[i])
-            df_all = pd.read_json(fullpath)
-            if (df_all['h_team'] == self.team).any() or (df_all['a_team'] == self.team).any():
-                df_team = pd.concat([df,df_all])
-                df = df_team
-        return df_team
-    
-    def __modify_dataframe(self,df):
-        df['important_team'] = np.where(df['h_a'] == 'h', df['h_team'], df['a_team']) ## Add the name of the team performed the action
-        return df
-    
-    def __add_data(self,df):
-        df['F/A'] = ['For'] * len(df)
-        part = df.copy()
-        part['important_team'] = part.apply(lambda x: x['h_team'] if x['important_team'] == x['a_team'] else x['a_team'], axis=1)
-        part['F/A'] = 'Against'
-        result = pd.concat([df, part], ignore_index=True)
-        return result
+    def __read_files(self,league,seasons,compact=False,mapped=False):
+        store = ShotStore(self.save_dir_path)
+        filters = [[('h_team','==',self.team)],[('a_team','==',self.team)]]
+        return store.load(league,seasons,columns=self.columns,filters=filters,compact=compact,mapped=mapped)
     
-    def load_team_data(self):
+    def load_team_data(self,compact=False,mapped=False):
+        ## compact=True returns a ShotTable (accepted by TeamAnalyzer) instead of a pandas frame; mapped=True
+        ## selects the team's shots from the memory-mapped columns of ShotStore.map_season (also a ShotTable)
         league = self.__find_team_league()
         self.__check_seasons()
-        d = pd.DataFrame()
-        for i in range(len(self.seasons)):
-            path = os.path.join(self.save_dir_path,self.dir_name,league,self.seasons[i])
-            df = self.__read_files(path)
-            df_t = pd.concat([d,df])
-            d = df_t
-        
-        df_t1 = self.__modify_dataframe(df_t)
-        df_team = self.__add_data(df_t1)
+        df_t = self.__read_files(league,self.seasons,compact,mapped)
+        if compact or mapped:
+            return df_t.mirror()
+        df_team = mirror_shots(df_t)
         return df_team
+    
+    def load_team_matches(self):
+        ## One row of aggregates per match of the team (from AggregateStore, no shot is read)
+        league = self.__find_team_league()
+        self.__check_seasons()
+        store = AggregateStore(self.save_dir_path)
+        return store.read("team_matches",league,self.seasons,filters=[('team','==',self.team)])
 
 ## Class to analyze data from all matches of a team
          
@@ -691,6 +2148,7 @@ class TeamAnalyzer:
         self.seasons = seasons
         self.team = team
         self.data = data
+        self.match_table = None
         #self.analyze_team()
     
     def __check_seasons(self):
@@ -706,50 +2164,65 @@ class TeamAnalyzer:
                 if int(f[1]) - int(f[0]) != 1:
                     exit("'seasons' cannot differ more than one. Modify")
     
+    def __find_match_table(self):
+        ## One grouped pass over the open-play shots of the team: per season and match the number of shots,
+        ## xG, big chances and summed shot distance, for and against
+        if self.match_table is not None:
+            return self.match_table
+        if isinstance(self.data,ShotTable):
+            return self.__find_match_table_compact()
+        if 'op_xG_for' in self.data.columns:   ## 'data' holds the match aggregates of TeamDataLoader.load_team_matches
+            matches = self.data[self.data['team'] == self.team].set_index(['season','match_id'])
+            columns = ['op_shots_for','op_shots_ag','op_xG_for','op_xG_ag','op_big_for','op_big_ag','op_dist_for','op_dist_ag']
+            self.match_table = matches[columns].rename(columns=lambda c: c[3:])
+            return self.match_table
+        if 'distance' not in self.data.columns:   ## Not read from the store ('team' and 'opponent' are kept as mirrored)
+            derived = ShotStore.derive(self.data)
+            self.data = self.data.assign(distance=derived['distance'],big_chance=derived['big_chance'])
+        shots = self.data[(self.data['important_team'] == self.team) & (self.data['situation'] == "OpenPlay")]
+        is_for = (shots['F/A'] == 'For').to_numpy()
+        xG = shots['xG'].to_numpy(dtype=float)
+        big = shots['big_chance'].to_numpy()
+        dist = shots['distance'].to_numpy(dtype=float)
+        values = pd.DataFrame({'season': shots['season'].to_numpy(), 'match_id': shots['match_id'].to_numpy(),
+                               'shots_for': is_for, 'shots_ag': ~is_for,
+                               'xG_for': np.where(is_for,xG,0.0), 'xG_ag': np.where(is_for,0.0,xG),
+                               'big_for': is_for & big, 'big_ag': ~is_for & big,
+                               'dist_for': np.where(is_for,dist,0.0), 'dist_ag': np.where(is_for,0.0,dist)})
+        self.match_table = values.groupby(['season','match_id']).sum()
+        return self.match_table
+    
+    def __find_match_table_compact(self):
+        ## As above, on a mirrored ShotTable (TeamDataLoader.load_team_data(compact=True))
+        data = self.data
+        shots = data.filter(data.mask('important_team',self.team) & data.mask('situation',"OpenPlay"))
+        is_for = shots.columns['F/A'] == shots.code('F/A','For')
+        xG = shots.columns['xG'].astype(float)
+        big = shots.columns['big_chance']
+        dist = shots.columns['distance'].astype(float)
+        values = {'shots_for': is_for, 'shots_ag': ~is_for,
+                  'xG_for': np.where(is_for,xG,0.0), 'xG_ag': np.where(is_for,0.0,xG),
+                  'big_for': is_for & big, 'big_ag': ~is_for & big,
+                  'dist_for': np.where(is_for,dist,0.0), 'dist_ag': np.where(is_for,0.0,dist)}
+        self.match_table = shots.group_sum(['season','match_id'],values).drop(columns='count').set_index(['season','match_id'])
+        return self.match_table
+    
     def __find_values(self,i):
-        year = self.seasons[i][0:4]
-        df_for = self.data[(self.data['season'] == int(year)) & (self.data['F/A'] == 'For') & (self.data['important_team'] == self.team) & (self.data['situation'] == "OpenPlay")]
-        df_ag = self.data[(self.data['season'] == int(year)) & (self.data['F/A'] == 'Against') & (self.data['important_team'] == self.team) & (self.data['situation'] == "OpenPlay")]
-        indices = list(set(df_for['match_id'].tolist()))
-        num_1 = len(indices)
-        num_2 = len(list(set(df_ag['match_id'].tolist())))
-        index = max(num_1,num_2)
-        
-        avg_xG_for = round(df_for['xG'].sum()/index,3)
-        avg_xG_ag = round(df_ag['xG'].sum()/index,3)
-        
-        xG_for_per_match, xG_ag_per_match, big_chances_for, big_chances_ag, dist_for_x, dist_for_y, dist_ag_x, dist_ag_y = [], [], [], [], [], [], [], []
-        for i in range(len(indices)):
-            xG_for_per_match.append(df_for[(df_for['important_team'] == self.team) & (df_for['match_id'] == indices[i]) & (df_for['F/A'] == 'For') & (df_for['situation'] == "OpenPlay")]['xG'].sum())
-            xG_ag_per_match.append(df_ag[(df_ag['important_team'] == self.team) & (df_ag['match_id'] == indices[i]) & (df_ag['F/A'] == 'Against') & (df_ag['situation'] == "OpenPlay")]['xG'].sum())
-            big_chances_for.append(df_for[(df_for['important_team'] == self.team) & (df_for['match_id'] == indices[i]) & (df_for['F/A'] == 'For') & (df_for['xG'] >= 0.4) & (df_for['situation'] == "OpenPlay")]['xG'].tolist())
-            big_chances_ag.append(df_ag[(df_ag['important_team'] == self.team) & (df_ag['match_id'] == indices[i]) & (df_ag['F/A'] == 'Against') & (df_ag['xG'] >= 0.4) & (df_ag['situation'] == "OpenPlay")]['xG'].tolist())
-            
-            dist_for_x.append(df_for[(df_for['important_team'] == self.team) & (df_for['match_id'] == indices[i]) & (df_for['F/A'] == 'For') & (df_for['situation'] == "OpenPlay")]['X'].tolist())
-            dist_for_y.append(df_for[(df_for['important_team'] == self.team) & (df_for['match_id'] == indices[i]) & (df_for['F/A'] == 'For') & (df_for['situation'] == "OpenPlay")]['Y'].tolist())
-            dist_ag_x.append(df_ag[(df_ag['important_team'] == self.team) & (df_ag['match_id'] == indices[i]) & (df_ag['F/A'] == 'Against') & (df_ag['situation'] == "OpenPlay")]['X'].tolist())
-            dist_ag_y.append(df_ag[(df_ag['important_team'] == self.team) & (df_ag['match_id'] == indices[i]) & (df_ag['F/A'] == 'Against') & (df_ag['situation'] == "OpenPlay")]['Y'].tolist())
-        xG_diff = [xG_for_per_match[i]-xG_ag_per_match[i] for i in range(len(xG_for_per_match))]
-        
-        a1, a2 = 0, 0
-        for i in range(len(big_chances_for)):
-            a1 = a1 + len(big_chances_for[i])
-        for i in range(len(big_chances_ag)):
-            a2 = a2 + len(big_chances_ag[i])
-        
-        flat_dist_for_x = [elem for sublist in dist_for_x for elem in sublist]
-        flat_dist_for_y = [elem for sublist in dist_for_y for elem in sublist]
-        flat_dist_ag_x = [elem for sublist in dist_ag_x for elem in sublist]
-        flat_dist_ag_y = [elem for sublist in dist_ag_y for elem in sublist]
-        
-        dist_for, dist_ag = [], []
-        for i in range(len(dist_for_x)):
-            dist_for.append(math.sqrt((122-flat_dist_for_x[i]*122)**2+(40-flat_dist_for_y[i]*40)**2))
-        for i in range(len(dist_ag_x)):
-            dist_ag.append(math.sqrt((122-flat_dist_ag_x[i]*122)**2+(40-flat_dist_ag_y[i]*40)**2))
-        
-        n_big_for, n_big_ag = a1/index, a2/index ## Big chances per game
-        distance_for, distance_ag = sum(dist_for)/len(dist_for), sum(dist_ag)/len(dist_ag) ## Average shoting distance 
+        year = int(self.seasons[i][0:4])
+        table = self.__find_match_table()
+        matches = table[table.index.get_level_values('season') == year]
+        played = matches[matches['shots_for'] > 0]   ## Matches in which the team had an open-play shot
+        index = max(len(played),int((matches['shots_ag'] > 0).sum()))
+        
+        avg_xG_for = round(matches['xG_for'].sum()/index,3)
+        avg_xG_ag = round(matches['xG_ag'].sum()/index,3)
+        
+        xG_for_per_match = played['xG_for'].tolist()
+        xG_ag_per_match = played['xG_ag'].tolist()
+        
+        n_big_for, n_big_ag = played['big_for'].sum()/index, played['big_ag'].sum()/index ## Big chances per game
+        distance_for = played['dist_for'].sum()/played['shots_for'].sum()  ## Average shoting distance
+        distance_ag = played['dist_ag'].sum()/played['shots_ag'].sum()
         return avg_xG_for, avg_xG_ag, xG_for_per_match, xG_ag_per_match, n_big_for, n_big_ag, distance_for, distance_ag
     
     def __plot_xG_fig(self,X1,X2):
@@ -814,6 +2287,16 @@ class TeamAnalyzer:
         ax4.set_xticklabels(self.seasons,rotation=90)
         ax4.set_ylabel("Average shot distance")
     
+    def season_values(self):
+        ## The values behind the figures of analyze_team: one row per season
+        self.__check_seasons()
+        rows = []
+        for i in range(len(self.seasons)):
+            f, a, data_for, data_ag, v1, v2, v3, v4 = self.__find_values(i)
+            rows.append({'season': self.seasons[i], 'matches': len(data_for), 'avg_xG_for': f, 'avg_xG_ag': a,
+                         'big_chances_for': v1, 'big_chances_ag': v2, 'distance_for': v3, 'distance_ag': v4})
+        return pd.DataFrame(rows)
+    
     def analyze_team(self):
         self.__check_seasons()
         xG_for, xG_ag, big_for, big_ag, dist_for, dist_ag = [], [], [], [], [], []
@@ -829,6 +2312,211 @@ class TeamAnalyzer:
         self.__plot_xG_fig(xG_for,xG_ag)
         self.__attack_defense(big_for,big_ag,dist_for,dist_ag)
 
+## Function to render the figures of one report with the Agg backend (runs in the worker processes of ReportRenderer)
+## job: ('league', league, seasons), ('team', team, seasons) or ('match', home_team, away_team, season)
+## save_players_csv: also saves the players' csv files of a league job, as LeagueAnalyzer does
+
+def render_job(job,save_dir_path,out_dir,formats,dpi,save_players_csv=False):
+    plt.switch_backend('Agg')
+    plt.close('all')
+    kind = job[0]
+    start = time.perf_counter()
+    try:
+        with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+            warnings.simplefilter('ignore')   ## plt.show() is a no-op without a display
+            if kind == 'league':
+                LeagueAnalyzer(job[1],job[2],save_dir_path,save_players_csv,mapped=True)
+            elif kind == 'team':
+                td = TeamDataLoader(job[2],job[1],save_dir_path)
+                TeamAnalyzer(td.load_team_matches(),job[2],job[1]).analyze_team()
+            elif kind == 'match':
+                vector = any(fmt.lower() not in PitchTemplate.raster_formats for fmt in formats)
+                MatchAnalyzer(MatchDataLoader(job[1],job[2],job[3],save_dir_path).load_match_data(),dpi=dpi,vector=vector).analyze_match()
+            else:
+                raise ValueError("Unknown report '" + str(kind) + "'")
+    except (Exception, SystemExit) as error:   ## The analyzers stop with exit() on invalid input
+        plt.close('all')
+        return {'job': list(job), 'error': str(error), 'build_seconds': time.perf_counter() - start, 'figures': []}
+    build = time.perf_counter() - start
+    parts = list(job[:4]) if kind == 'match' else list(job[:2]) + list(job[2])   ## The seasons make the names unique
+    name = "_".join(str(x) for x in parts).replace(" ","_")
+    figures = []
+    for k, number in enumerate(plt.get_fignums()):
+        fig = plt.figure(number)
+        start = time.perf_counter()
+        files = []
+        for fmt in formats:
+            files.append(os.path.join(out_dir, name + "_" + str(k+1) + "." + fmt))
+            fig.savefig(files[-1],dpi=dpi)
+        plt.close(fig)   ## Frees the figure: a worker renders many reports
+        figures.append({'files': files, 'seconds': time.perf_counter() - start})
+    return {'job': list(job), 'build_seconds': build, 'figures': figures}
+
+## Class to render many reports without a display: the jobs run in a process pool and every figure is written to disk
+
+class ReportRenderer:
+    def __init__(self,save_dir_path=os.getcwd(),out_dir=None,formats=('png',),workers=None,dpi=100):
+        self.save_dir_path = save_dir_path
+        self.dir_name = "Football_Data"
+        self.out_dir = out_dir if out_dir is not None else os.path.join(self.save_dir_path,self.dir_name,"reports")
+        self.formats = list(formats)   ## Any format of matplotlib's savefig, e.g. 'png' and 'svg'
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.dpi = dpi
+        self.timings = []
+    
+    def render(self,jobs):
+        ## Returns per job the time to build its figures and per figure the written files and the time to render them
+        os.makedirs(self.out_dir, exist_ok=True)
+        jobs = [tuple(job) for job in jobs]
+        store = ShotStore(self.save_dir_path)
+        for job in jobs:   ## The columns are exported once here, the workers only map them
+            if job[0] == 'league' and isinstance(job[2],(list,tuple)):
+                for season in job[2]:
+                    try:
+                        store.map_season(job[1],season)
+                    except (OSError, ValueError):   ## Reported by the job itself
+                        pass
+        results = [None] * len(jobs)
+        progress = tqdm_notebook.tqdm(total=len(jobs),desc='Reports',leave=False)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max(1,min(self.workers,len(jobs)))) as executor:
+            futures = dict((executor.submit(render_job,job,self.save_dir_path,self.out_dir,self.formats,self.dpi), i) for i, job in enumerate(jobs))
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+                progress.update(1)
+        progress.close()
+        self.timings = results
+        for result in results:
+            if 'error' in result:
+                print(" ".join(str(x) for x in result['job']) + ": failed (" + result['error'] + ")")
+                continue
+            print(" ".join(str(x) for x in result['job']) + ": built in {:.1f} ms".format(result['build_seconds']*1000))
+            for figure in result['figures']:
+                print("   {}: {:.1f} ms".format(", ".join(os.path.basename(f) for f in figure['files']),figure['seconds']*1000))
+        return results
+
+## Class to answer match, team and league queries over HTTP from one long-running process. The loaded seasons stay
+## in memory ('season_cache'), so only the first query of a season reads from disk. Every query returns JSON
+## records, or with format=png one of the figures of the analysis (figure=1, 2, ...):
+##   /match?home=..&away=..&season=..               table of analyze_match (png: the shot map)
+##   /matches?league=..&season=..                   analyze_matches for every match of the season
+##   /team?team=..&seasons=2021-2022,2022-2023      TeamAnalyzer.season_values (png: the figures of analyze_team)
+##   /league?league=..&season=..[&table=players]    team or player table of the season (png: the figures of LeagueAnalyzer)
+
+class QueryServer:
+    def __init__(self,save_dir_path=os.getcwd(),host="127.0.0.1",port=8000,preload=None):
+        self.save_dir_path = save_dir_path
+        self.host = host
+        self.port = port
+        self.preload = preload if preload is not None else []   ## (league, season) pairs loaded before the first query
+        self.plot_lock = threading.Lock()   ## pyplot is not thread-safe: the figures are drawn one query at a time
+        self.httpd = None
+    
+    def __json(self,table):
+        return 200, "application/json", table.to_json(orient='records').encode('utf8')
+    
+    def __png(self,draw,figure):
+        ## Draws the figures of the query, saves the requested one and closes them all. Everything runs under
+        ## 'plot_lock': another query would otherwise draw on (or close) the same pyplot figure numbers
+        with self.plot_lock, warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+            warnings.simplefilter('ignore')
+            before = set(plt.get_fignums())
+            try:
+                draw()
+                numbers = [n for n in plt.get_fignums() if n not in before]
+                if figure < 1 or figure > len(numbers):
+                    return 404, "application/json", json.dumps({'error': "Figure " + str(figure) + " does not exist"}).encode('utf8')
+                buffer = io.BytesIO()
+                plt.figure(numbers[figure-1]).savefig(buffer,format='png')
+                return 200, "image/png", buffer.getvalue()
+            finally:
+                for number in plt.get_fignums():
+                    if number not in before:
+                        plt.close(number)
+    
+    def __match(self,params):
+        data = MatchDataLoader(params['home'],params['away'],params['season'],self.save_dir_path).load_match_data()
+        if params.get('format') == 'png':
+            draw = lambda: MatchAnalyzer(data,dpi=plt.rcParams['figure.dpi']).analyze_match()
+            return self.__png(draw,int(params.get('figure',1)))
+        table = MatchAnalyzer(data,plot=False).analyze_match()
+        return self.__json(table.reset_index(names='metric'))
+    
+    def __matches(self,params):
+        data = ShotStore(self.save_dir_path).read(params['league'],params['season'])
+        if len(data) == 0:
+            return 404, "application/json", json.dumps({'error': "No data for " + params['league'] + " " + params['season']}).encode('utf8')
+        return self.__json(MatchAnalyzer.analyze_matches(data))
+    
+    def __team(self,params):
+        seasons = params['seasons'].split(",")
+        data = TeamDataLoader(seasons,params['team'],self.save_dir_path).load_team_matches()
+        if len(data) == 0:
+            return 404, "application/json", json.dumps({'error': "No data for " + params['team'] + " " + params['seasons']}).encode('utf8')
+        team = TeamAnalyzer(data,seasons,params['team'])
+        if params.get('format') == 'png':
+            return self.__png(team.analyze_team,int(params.get('figure',1)))
+        return self.__json(team.season_values())
+    
+    def __league(self,params):
+        league, season = params['league'], params['season']
+        shots = ShotStore(self.save_dir_path).read(league,season,columns=['result','player','xG'])
+        if len(shots) == 0:
+            return 404, "application/json", json.dumps({'error': "No data for " + league + " " + season}).encode('utf8')
+        if params.get('format') == 'png':
+            return self.__png(lambda: LeagueAnalyzer(league,[season],self.save_dir_path),int(params.get('figure',1)))
+        aggregates = LeagueAggregator(shots,AggregateStore(self.save_dir_path).read("team_matches",league,[season]))
+        if params.get('table') == 'players':
+            return self.__json(aggregates.player_table())
+        return self.__json(aggregates.team_table().reset_index())
+    
+    def query(self,path,params):
+        ## Returns (HTTP status, content type, body) of one query
+        handlers = {'/match': self.__match, '/matches': self.__matches, '/team': self.__team, '/league': self.__league}
+        required = {'/match': ['home','away','season'], '/matches': ['league','season'], '/team': ['team','seasons'],
+                    '/league': ['league','season']}
+        if path not in handlers:
+            return 404, "application/json", json.dumps({'error': "Unknown query " + path}).encode('utf8')
+        missing = [name for name in required[path] if name not in params]
+        if len(missing) > 0:
+            return 400, "application/json", json.dumps({'error': "Missing parameter '" + missing[0] + "'"}).encode('utf8')
+        try:
+            return handlers[path](params)
+        except (Exception, SystemExit) as error:   ## The loaders and analyzers stop with exit() on invalid input
+            return 400, "application/json", json.dumps({'error': str(error)}).encode('utf8')
+    
+    def serve(self):
+        ## Blocks and answers queries (on several threads) until interrupted
+        plt.switch_backend('Agg')
+        for league, season in self.preload:
+            ShotStore(self.save_dir_path).read(league,season)
+            AggregateStore(self.save_dir_path).read("team_matches",league,[season])
+        queries = self
+        
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                start = time.perf_counter()
+                url = urllib.parse.urlparse(self.path)
+                params = dict((k, v[-1]) for k, v in urllib.parse.parse_qs(url.query).items())
+                status, content_type, body = queries.query(url.path,params)
+                self.send_response(status)
+                self.send_header("Content-Type",content_type)
+                self.send_header("Content-Length",str(len(body)))
+                self.send_header("X-Elapsed-ms","{:.1f}".format((time.perf_counter() - start)*1000))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self,format,*args):
+                pass
+        
+        self.httpd = http.server.ThreadingHTTPServer((self.host,self.port),Handler)
+        print("Serving queries on http://{}:{}".format(self.host,self.httpd.server_port))
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.httpd.server_close()
+
 class CheckFile:
     def __init__(self):
         script_directory = os.path.dirname(os.path.abspath(__file__))
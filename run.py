@@ -5,6 +5,7 @@ get_data =       False   ## Scrapes data from https://understat.com/ and saves t
 analyze_match =  False   ## Plots the position of all shots of a given match and provides a table with information
 analyze_league = False   ## Plots xG figure for the teams of the selected league over the selected seasons
 analyze_team =   False   ## Plots xG figure for the selected team over the selected seasons
+serve_queries =  False   ## Keeps the data in memory and answers match, team and league queries over HTTP
 
 ## Relevant if get_data = True
 save_csv_file_leagues = True   ## Saves league’s data to csv file
@@ -13,7 +14,14 @@ save_csv_file_leagues = True   ## Saves league’s data to csv file
 save_csv_file_players = True   ## Saves players’ data to csv file
 
 ## Relevant if update_id_file = True
-parallel = True    ## Activates multiprocessing. It might be unstable for some IDEs if True
+parallel = True    ## Requests several pages concurrently for faster results
+incremental = True ## Scans only the IDs after the last known match and merges them into 'league_ids.dat'
+
+## Relevant if update_id_file = True or get_data = True
+replay = False     ## Parses again the pages kept in 'Football_Data/pages' without contacting understat
+
+## Relevant if serve_queries = True
+port = 8000   ## Queries are answered on http://127.0.0.1:port (e.g. /team?team=Arsenal&seasons=2021-2022,2022-2023)
 
 ## Relavant for all tags
 save_dir_path = ""  ## Saving directory. Default: current working directory. Empty string activates the default setting. 
@@ -35,26 +43,32 @@ league = "Bundesliga"   ## Choose league to analyze. Available leagues: Ligue1,
 ## Relavant if analyze_team = True
 team = "Arsenal"       ## Available teams: all teams
 
-if update_id_file:
-    ids = mfa.FindIDs(parallel,save_dir_path)
-
-if get_data:
-    data = mfa.DataUpdater(leagues,seasons,save_dir_path,save_csv_file_leagues)
-    
-if analyze_match:
-    md = mfa.MatchDataLoader(home_team,away_team,season,save_dir_path)
-    match_data = md.load_match_data()
-    
-    match = mfa.MatchAnalyzer(match_data)
-    table = match.analyze_match()
-    print(table)
-    
-if analyze_league:
-    league_data = mfa.LeagueAnalyzer(league,seasons,save_dir_path,save_csv_file_players)
-    
-if analyze_team:
-    td = mfa.TeamDataLoader(seasons,team,save_dir_path)
-    team_data = td.load_team_data()
-    
-    team_analysis = mfa.TeamAnalyzer(team_data,seasons,team)
-    team_analysis.analyze_team()
\ No newline at end of file
+## Needed by the worker processes on Windows and macOS, which import this file again
+if __name__ == "__main__":
+    if update_id_file:
+        ids = mfa.FindIDs(parallel,save_dir_path,incremental,replay=replay)
+
+    if get_data:
+        data = mfa.DataUpdater(leagues,seasons,save_dir_path,save_csv_file_leagues,replay=replay)
+
+    if analyze_match:
+        md = mfa.MatchDataLoader(home_team,away_team,season,save_dir_path)
+        match_data = md.load_match_data()
+
+        match = mfa.MatchAnalyzer(match_data)
+        table = match.analyze_match()
+        print(table)
+
+    if analyze_league:
+        league_data = mfa.LeagueAnalyzer(league,seasons,save_dir_path,save_csv_file_players)
+
+    if analyze_team:
+        td = mfa.TeamDataLoader(seasons,team,save_dir_path)
+        team_data = td.load_team_matches()   ## Per match aggregates. load_team_data() returns the shots
+
+        team_analysis = mfa.TeamAnalyzer(team_data,seasons,team)
+        team_analysis.analyze_team()
+
+    if serve_queries:
+        server = mfa.QueryServer(save_dir_path,port=port)
+        server.serve()
\ No newline at end of file
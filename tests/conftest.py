@@ -0,0 +1,81 @@
+## Shared fixtures: a local stub of https://understat.com/ serving scripted responses per match ID
+
+import os
+import sys
+import json
+import threading
+import collections
+import http.server
+import socketserver
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+## Function to escape a JSON string the way understat embeds it (every non alphanumeric character as \xNN)
+
+def escape(text):
+    return ''.join(c if c.isalnum() or c in ' .' else '\\x%02X' % ord(c) for c in text)
+
+## Function to build a match page with the understat layout. shots: {'h': [...], 'a': [...]}
+
+def match_page(shots):
+    return ("<html><head><title>Match</title><script src=\"js/jquery.js\"></script></head><body>"
+            "<script>\n\tvar shotsData\t= JSON.parse('" + escape(json.dumps(shots)) + "');\n</script>"
+            "<script>\n\tvar rostersData\t= JSON.parse('" + escape(json.dumps({})) + "');\n</script>"
+            "</body></html>").encode('utf8')
+
+## Function to build the shots of a match (one shot per side, or none if the match is not played yet)
+
+def match_shots(match_id,h_team="Bayern Munich",a_team="FC Cologne",season=2022,played=True,xG="0.25"):
+    if not played:
+        return {'h': [], 'a': []}
+    shots = {'h': [], 'a': []}
+    for k, side in enumerate(('h','a')):
+        shots[side].append({'id': str(match_id*10 + k), 'minute': str(10 + k), 'result': 'Goal' if side == 'h' else 'SavedShot',
+                            'X': '0.9', 'Y': '0.5', 'xG': xG, 'player': 'Player ' + side, 'h_a': side,
+                            'player_id': str(k + 1), 'situation': 'OpenPlay', 'season': str(season), 'shotType': 'RightFoot',
+                            'match_id': str(match_id), 'h_team': h_team, 'a_team': a_team, 'h_goals': '1', 'a_goals': '0',
+                            'date': str(season) + '-09-01 15:30:00', 'player_assisted': None, 'lastAction': 'Pass'})
+    return shots
+
+## Class of the stub server: responses[match_id] is a list of (status, body) served in order, the last one repeated
+
+class StubServer:
+    def __init__(self):
+        self.responses = {}
+        self.hits = collections.Counter()   ## match_id -> number of requests
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                match_id = self.path.rstrip("/").split("/")[-1]
+                stub.hits[match_id] += 1
+                script = stub.responses.get(match_id,[(404, b"")])
+                status, body = script[min(stub.hits[match_id],len(script)) - 1]
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self,*args):
+                pass
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = "http://127.0.0.1:%d/match/" % self.server.server_address[1]
+
+    def page(self,match_id,body,status=200):
+        self.responses[str(match_id)] = [(status, body)]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    yield server
+    server.close()
@@ -0,0 +1,44 @@
+## PageFetcher against the local stub server of conftest.py
+
+from myfootballanalytics.mfa import PageFetcher, PageCache
+
+def fetcher(stub,**options):
+    return PageFetcher(base_url=stub.base_url,rate=None,backoff=0.01,**options)
+
+def test_pages_in_order(stub):
+    for match_id in range(1,6):
+        stub.page(match_id,b"page " + str(match_id).encode())
+    assert fetcher(stub).fetch_all(range(1,6)) == [b"page " + str(m).encode() for m in range(1,6)]
+
+def test_missing_page_is_not_retried(stub):
+    assert fetcher(stub).fetch_all([7]) == [None]
+    assert stub.hits['7'] == 1
+
+def test_client_error_is_not_retried(stub):
+    stub.page(8,b"forbidden",status=403)
+    assert fetcher(stub).fetch_all([8]) == [None]
+    assert stub.hits['8'] == 1
+
+def test_server_errors_and_rate_limit_are_retried(stub):
+    stub.responses['9'] = [(503, b""), (429, b""), (200, b"page 9")]
+    assert fetcher(stub,retries=3).fetch_all([9]) == [b"page 9"]
+    assert stub.hits['9'] == 3
+
+def test_retries_are_bounded(stub):
+    stub.page(10,b"",status=500)
+    assert fetcher(stub,retries=2).fetch_all([10]) == [None]
+    assert stub.hits['10'] == 3
+
+def test_fetch_each_calls_back_every_id(stub):
+    for match_id in range(1,4):
+        stub.page(match_id,b"page")
+    received = {}
+    fetcher(stub,concurrency=2).fetch_each([1,2,3,4],lambda i, content: received.__setitem__(i,content))
+    assert received == {0: b"page", 1: b"page", 2: b"page", 3: None}
+
+def test_replay_serves_the_cached_pages(stub,tmp_path):
+    stub.page(11,b"page 11")
+    fetcher(stub,cache=PageCache(str(tmp_path))).fetch_all([11,12])
+    stub.close()
+    replay = PageFetcher(cache=PageCache(str(tmp_path)),replay=True)
+    assert replay.fetch_all([11,12]) == [b"page 11", None]
@@ -0,0 +1,15 @@
+## FindIDs against the local stub server of conftest.py
+
+import os
+
+from conftest import match_page, match_shots
+from myfootballanalytics.mfa import FindIDs, PageFetcher
+
+def test_incremental_scan_in_the_working_directory(stub,tmp_path,monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(FindIDs,"_FindIDs__boundaries",lambda self: [str(i) for i in range(1,30)])
+    for match_id in range(1,6):
+        stub.page(match_id,match_page(match_shots(match_id)))
+    FindIDs(True,"",incremental=True,max_misses=10,fetcher=PageFetcher(base_url=stub.base_url,rate=None),cache=False)
+    assert os.path.isfile(os.path.join(str(tmp_path),"league_ids.dat"))
+    assert os.path.isfile(os.path.join(str(tmp_path),"league_ids_state.json"))
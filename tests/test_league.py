@@ -0,0 +1,8 @@
+## LeagueAnalyzer on seasons that were not downloaded
+
+from myfootballanalytics.mfa import LeagueAnalyzer
+
+def test_season_without_data_is_reported(tmp_path,capsys):
+    analyzer = LeagueAnalyzer("Bundesliga",["2021-2022","2022-2023"],str(tmp_path),plot=False)
+    assert [analyzer.results[s]['error'] for s in ["2021-2022","2022-2023"]] == ["No data for Bundesliga 2021-2022", "No data for Bundesliga 2022-2023"]
+    assert "No data for Bundesliga 2022-2023" in capsys.readouterr().out
@@ -0,0 +1,34 @@
+## Page parsing on the real understat pages of benchmarks/fixtures/understat
+
+import os
+
+import pytest
+
+from myfootballanalytics.mfa import parse_match_page, normalize_match
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "fixtures", "understat")
+PAGES = sorted(f for f in os.listdir(PAGES_DIR) if f.endswith(".html"))
+
+def read(name):
+    with open(os.path.join(PAGES_DIR,name),'rb') as rf:
+        return rf.read()
+
+@pytest.mark.parametrize("name",PAGES)
+def test_extractor_agrees_with_beautifulsoup(name):
+    content = read(name)
+    shots = parse_match_page(content)
+    assert len(shots['h']) + len(shots['a']) > 0
+    assert shots == parse_match_page(content,fast=False)
+
+@pytest.mark.parametrize("name",PAGES)
+def test_normalized_shots_belong_to_the_page(name):
+    data = normalize_match(read(name))
+    assert set(data['match_id']) == {int(name[:-len(".html")])}
+    assert data['X'].between(0,1).all() and data['Y'].between(0,1).all() and data['xG'].between(0,1).all()
+
+def test_crystal_palace_manchester_united():
+    data = normalize_match(read("14717.html"))
+    assert data['h_a'].value_counts().to_dict() == {'a': 11, 'h': 8}
+    assert set(data['h_team'].astype(str)) == {"Crystal Palace"} and set(data['a_team'].astype(str)) == {"Manchester United"}
+    assert (data['result'] == 'Goal').sum() == 0
+    assert data['xG'].sum() == pytest.approx(1.3299,abs=1e-4)
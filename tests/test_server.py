@@ -0,0 +1,25 @@
+## QueryServer.query without the HTTP layer
+
+import json
+
+from myfootballanalytics.mfa import QueryServer
+
+def query(tmp_path,path,params):
+    status, content_type, body = QueryServer(str(tmp_path)).query(path,params)
+    return status, json.loads(body)
+
+def test_missing_parameter(tmp_path):
+    assert query(tmp_path,'/team',{'team': 'Arsenal'}) == (400, {'error': "Missing parameter 'seasons'"})
+    assert query(tmp_path,'/match',{'home': 'Arsenal', 'away': 'Chelsea'}) == (400, {'error': "Missing parameter 'season'"})
+
+def test_unknown_team_is_not_a_missing_parameter(tmp_path):
+    status, body = query(tmp_path,'/team',{'team': 'Nope', 'seasons': '2022-2023'})
+    assert status == 400
+    assert body['error'] == "Team 'Nope' is not found. Make sure it is spelled correctly"
+
+def test_unknown_query(tmp_path):
+    assert query(tmp_path,'/players',{})[0] == 404
+
+def test_no_stored_data(tmp_path):
+    assert query(tmp_path,'/league',{'league': 'Bundesliga', 'season': '2022-2023'}) == (404, {'error': "No data for Bundesliga 2022-2023"})
+    assert query(tmp_path,'/team',{'team': 'Bayern Munich', 'seasons': '2022-2023'}) == (404, {'error': "No data for Bayern Munich 2022-2023"})
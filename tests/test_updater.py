@@ -0,0 +1,87 @@
+## DataUpdater against the local stub server of conftest.py
+
+import os
+import json
+
+import pytest
+
+from conftest import match_page, match_shots
+from myfootballanalytics.mfa import DataUpdater, PageFetcher, ShotStore
+
+LEAGUE = "Bundesliga"
+SEASON = "2022-2023"
+
+def write_ids(save_dir,match_ids):
+    with open(os.path.join(save_dir,"league_ids.dat"),'w') as wf:
+        wf.write(LEAGUE + ": " + SEASON + ": " + " ".join(str(m) for m in match_ids) + "\n")
+
+def update(stub,save_dir):
+    return DataUpdater([LEAGUE],[SEASON],save_dir,fetcher=PageFetcher(base_url=stub.base_url,rate=None,backoff=0.01),workers=0,cache=False)
+
+def stored_ids(save_dir):
+    return sorted(int(m) for m in ShotStore(save_dir).read(LEAGUE,SEASON,columns=['match_id'])['match_id'].unique())
+
+def manifest_ids(save_dir):
+    with open(os.path.join(save_dir,"Football_Data","manifest.json"),'r') as rf:
+        return sorted(int(m) for m in json.load(rf))
+
+def test_stored_matches_are_not_fetched_again(stub,tmp_path):
+    save_dir = str(tmp_path)
+    for match_id in (100,101):
+        stub.page(match_id,match_page(match_shots(match_id)))
+    write_ids(save_dir,[100,101])
+    update(stub,save_dir)
+    assert stored_ids(save_dir) == [100,101]
+    update(stub,save_dir)
+    assert stub.hits['100'] == 1 and stub.hits['101'] == 1
+
+@pytest.mark.parametrize("workers",[0,1])
+def test_invalid_match_is_left_out(stub,tmp_path,capsys,workers):
+    save_dir = str(tmp_path)
+    stub.page(400,match_page(match_shots(400)))
+    stub.page(401,match_page(match_shots(401,xG="1.5")))   ## xG outside [0, 1]
+    stub.page(402,match_page(match_shots(402)))
+    write_ids(save_dir,[400,401,402])
+    DataUpdater([LEAGUE],[SEASON],save_dir,fetcher=PageFetcher(base_url=stub.base_url,rate=None),workers=workers,cache=False)
+    assert "Match 401: " in capsys.readouterr().out
+    assert stored_ids(save_dir) == [400,402]
+    assert manifest_ids(save_dir) == [400,402]
+    stub.page(401,match_page(match_shots(401)))
+    update(stub,save_dir)
+    assert stored_ids(save_dir) == [400,401,402]
+
+def test_match_not_played_yet_is_fetched_again(stub,tmp_path):
+    save_dir = str(tmp_path)
+    stub.page(300,match_page(match_shots(300,played=False)))
+    stub.page(301,match_page(match_shots(301)))
+    write_ids(save_dir,[300,301])
+    update(stub,save_dir)
+    assert manifest_ids(save_dir) == [301]
+    stub.page(300,match_page(match_shots(300)))
+    update(stub,save_dir)
+    assert stub.hits['300'] == 2
+    assert stored_ids(save_dir) == [300,301]
+
+## Fetcher that delivers the first pages and then fails, like a run interrupted half-way through a season
+
+class FailingFetcher(PageFetcher):
+    def __init__(self,base_url,delivered):
+        PageFetcher.__init__(self,base_url=base_url,rate=None)
+        self.delivered = delivered
+
+    def fetch_each(self,match_ids,callback):
+        for i, content in enumerate(self.fetch_all(list(match_ids)[:self.delivered])):
+            callback(i,content)
+        raise RuntimeError("connection lost")
+
+def test_interrupted_season_is_not_recorded(stub,tmp_path):
+    save_dir = str(tmp_path)
+    for match_id in (200,201,202):
+        stub.page(match_id,match_page(match_shots(match_id)))
+    write_ids(save_dir,[200,201,202])
+    with pytest.raises(RuntimeError):
+        DataUpdater([LEAGUE],[SEASON],save_dir,fetcher=FailingFetcher(stub.base_url,2),workers=0,cache=False)
+    assert not os.path.isfile(os.path.join(save_dir,"Football_Data","manifest.json")) or manifest_ids(save_dir) == []
+    update(stub,save_dir)
+    assert stored_ids(save_dir) == [200,201,202]
+    assert manifest_ids(save_dir) == [200,201,202]